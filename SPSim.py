@@ -24,9 +24,11 @@ import pvspice
 import os.path
 import numpy as np
 import os
-import subprocess
 import matplotlib.pyplot as plt
 
+#Seconds after which a SPICE simulation is considered hung and is killed
+SIMULATION_TIMEOUT = 3600
+
 class Window: #Main window
 	def __init__ (self, master):
 		#Internal variable initialization
@@ -54,6 +56,10 @@ status and data output. Keep it open during the simulations.\n")
 		#Creating the workspace directory
 		os.makedirs("workspace", exist_ok = True)
 		self.work_abs_path = os.path.abspath('workspace')
+		#Cache of the fitted panel parameters, shared by all the grids
+		self.parameters_cache = pvspice.parameters_cache(os.path.join(self.work_abs_path, "parameters_cache.json"))
+		#Results of the simulations, an unchanged grid is not simulated again
+		self.result_cache = pvspice.result_cache(os.path.join(self.work_abs_path, "result_cache"))
 
 		#CVUT icon
 		try:
@@ -236,6 +242,18 @@ status and data output. Keep it open during the simulations.\n")
 		self.check2 = Checkbutton(frame4, text="Probe diodes current", variable=self.checkbox2)
 		self.check2.grid(row=3, column=0, columnspan = 2, padx = 10, sticky=W)
 
+		self.checkbox3 = BooleanVar()
+		self.check3 = Checkbutton(frame4, text="Native solver (no LTspice)", variable=self.checkbox3)
+		self.check3.grid(row=4, column=0, columnspan = 2, padx = 10, sticky=W)
+
+		self.checkbox4 = BooleanVar()
+		self.check4 = Checkbutton(frame4, text="Hierarchical netlist", variable=self.checkbox4)
+		self.check4.grid(row=5, column=0, columnspan = 2, padx = 10, sticky=W)
+
+		self.checkbox5 = BooleanVar()
+		self.check5 = Checkbutton(frame4, text="Adaptive sweep", variable=self.checkbox5)
+		self.check5.grid(row=6, column=0, columnspan = 2, padx = 10, sticky=W)
+
 		self.button7 = Button(frame4, text = "Simulate", command = self.run_simulation_routine)
 		self.button7.grid(row=3, column=2, padx = 10)
 
@@ -355,7 +373,10 @@ status and data output. Keep it open during the simulations.\n")
 			return
 		#Open selected file and extract data
 		self.file_output = pvspice.extract_raw_file(self.raw_abs_path)
+		self.show_result()
 
+	#Fills the listboxes with the probes of the current result (self.file_output)
+	def show_result(self):
 		#Get file name
 		self.stringvar_opened_file.set(self.file_output.name)
 
@@ -392,6 +413,15 @@ status and data output. Keep it open during the simulations.\n")
 			self.node_listbox.append(probe)
 			self.node_listbox[-1].color = this_color
 
+	#Clears the listboxes and drops the current result (and the file it may keep memory mapped)
+	def release_result(self):
+		self.listbox.delete(0, END)
+		self.listbox2.delete(0, END)
+		self.node_listbox = []
+		self.node_listbox2 = []
+		self.file_output = None
+		self.stringvar_opened_file.set("")
+
 	#Routine that actually runs the SPICE simulation
 	def run_simulation_routine(self):
 		try:
@@ -411,23 +441,75 @@ status and data output. Keep it open during the simulations.\n")
 		os.makedirs("workspace", exist_ok = True)
 		os.makedirs( filedir, exist_ok = True)
 
-		#Creating a new netlist to be executed
-		new_netlist = pvspice.netlist(filename)
-		circuit = new_netlist.defaultRun( self.grid, self.grid.nserie*(self.grid.parameters.Voc + 1), float( self.e_precision.get() ),
-						probe_strings = self.checkbox1.get(), probe_bypassdiode = self.checkbox2.get() )
+		#Looking for the same simulation on the result cache (the key is a hash of the netlist lines, nothing is written)
+		upperv = self.grid.nserie*(self.grid.parameters.Voc + 1)
+		precision = float( self.e_precision.get() )
+		hierarchical = self.checkbox4.get() and not self.checkbox3.get()
+		simulator = pvspice.pvsolver() if self.checkbox3.get() else pvspice.jobrunner(timeout = SIMULATION_TIMEOUT)
+		backend = simulator.backendKey() + (" adaptive" if self.checkbox5.get() else "")
+		key = self.result_cache.key( pvspice.netlist(filename).iterDefaultNetlist( self.grid, upperv, precision, probe_strings = self.checkbox1.get(),
+						probe_bypassdiode = self.checkbox2.get(), hierarchical = hierarchical ), backend )
+		cached_output = self.result_cache.get(key, filename)
+		if cached_output is not None:
+			self.release_result()
+			self.file_output = cached_output
+			self.raw_abs_path = os.path.abspath(filedir + filename + ".raw")
+			self.show_result()
+			print ("{} were found on the result cache ({}).\n".format(filename, self.result_cache.report()))
+			return
+
+		#The adaptive sweep chooses the bias voltages pass after pass ("precision" is its smallest step), so its output
+		#is merged from all the passes and shown directly, as the one of the native solver
+		if self.checkbox5.get():
+			print ("Simulation is running (adaptive sweep)...")
+			self.release_result()
+			try:
+				if self.checkbox3.get():
+					self.file_output = simulator.adaptiveRun( self.grid, upperv, precision, probe_strings = self.checkbox1.get(),
+								probe_bypassdiode = self.checkbox2.get(), name = filename )
+				else:
+					self.file_output = simulator.adaptiveRun( self.grid, upperv, precision, filedir + filename, probe_strings = self.checkbox1.get(),
+								probe_bypassdiode = self.checkbox2.get(), hierarchical = hierarchical, name = filename )
+			except RuntimeError as error:
+				messagebox.showerror("Error", str(error))
+				return
+			self.result_cache.put(key, self.file_output)
+			self.raw_abs_path = os.path.abspath(filedir + filename + ".raw")
+			self.show_result()
+			print ("{} were simulated with {} bias voltages.\n".format(filename, len(self.file_output.probe_vbias.values)))
+			return
 
-		#Writting the .cir file
+		#The native solver runs in-process and its output is shown directly (raw_abs_path only names the CSV file)
+		if self.checkbox3.get():
+			print ("Simulation is running (native solver)...")
+			self.file_output = simulator.defaultRun( self.grid, upperv, precision,
+						probe_strings = self.checkbox1.get(), probe_bypassdiode = self.checkbox2.get(), name = filename )
+			self.result_cache.put(key, self.file_output)
+			self.raw_abs_path = os.path.abspath(filedir + filename + ".raw")
+			self.show_result()
+			print ("{} were simulated by the native solver.\n".format(filename))
+			return
+
+		#Creating a new netlist and writting it on the .cir file (the lines are streamed to the file)
+		new_netlist = pvspice.netlist(filename)
 		f = open(filedir + filename + ".cir","w")
-		for string in circuit:
-			f.write(string+"\n")
+		new_netlist.writeNetlist( f, self.grid, upperv, precision,
+						probe_strings = self.checkbox1.get(), probe_bypassdiode = self.checkbox2.get(), hierarchical = hierarchical )
 		f.close()
 
+		#The binary .raw output is smaller and faster to write. An opened binary result is memory mapped, so it is
+		#released before LTspice overwrites it
+		self.release_result()
 		print ("Simulation is running...")
-		subprocess.call(["scad3", "-ascii", "-b", "-run", "".join([filedir,filename,".cir"])])
+		job = simulator.runJob( pvspice.simulationjob("".join([filedir,filename,".cir"])) )
+		if job.error is not None:
+			messagebox.showerror("Error", "The simulation of {}.cir failed: {}".format(filename, job.error))
+			return
+		self.result_cache.put(key, job.result)
+		del job
 		print ("{}.cir were simulated. Output stored in: {} \n".format(filename, filedir))
 
 		del new_netlist
-		del circuit
 
 	#Function that creates the grid of panels from the input values and bypass config.
 	def datasheet_apply_function(self):  
@@ -446,7 +528,7 @@ status and data output. Keep it open during the simulations.\n")
 			return
 
 		print ("Grid of panels creation were successful\n")
-		self.grid = pvspice.pvgrid(nserie,nparallel,Voc,Isc,Vmp,Imp,Kv,Ki,Ns)
+		self.grid = pvspice.pvgrid(nserie,nparallel,Voc,Isc,Vmp,Imp,Kv,Ki,Ns,cache=self.parameters_cache)
 		self.I0, self.Iph, self.Rs, self.Rsh, self.A = self.grid.parameters.get_parameters(25.0)
 
 		self.e_I0.delete(0, END)
@@ -473,7 +555,7 @@ status and data output. Keep it open during the simulations.\n")
 			messagebox.showerror("Error", "Create a grid first")
 			return
 
-		self.grid.parameters.routine() 
+		self.grid.parameters.routineCached() 
 		I0, Iph, Rs, Rsh, A = self.grid.parameters.get_parameters(25.0)
 
 		self.e_I0.delete(0, END)
@@ -1167,7 +1249,7 @@ status and data output. Keep it open during the simulations.\n")
 					new_temp = float( entry.get() )
 				except ValueError:
 					return
-				panel.diode_temp[idx] = new_temp
+				panel.setDiodeTemp(idx, new_temp)
 			self.turnoff_bypasstemp()
 
 		def create_bypasstemp_apply_button(panel,entry_list):
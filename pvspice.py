@@ -11,9 +11,39 @@ GNU GENERAL PUBLIC LICENSE Version 3.0, June 2007
 """
 
 from os import system
+from collections import OrderedDict
+from itertools import chain
 import os.path
+import sys
+import csv
+import copy
+import json
+import hashlib
+import tempfile
+import subprocess
+import shlex
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import numpy as np
 
+""" Dbypass is the name given to the model of the bypass diode. The information that follows are the configurations
+	of an schottky diode, usually used as bypass diodes for PV modules. Parameters may be adapted to different models
+	if the values are known. They are shared by the SPICE netlist and by the native solver (class pvsolver) """
+DBYPASS_MODEL = { "IS": 3.47597e-05, "RS": 0.00960369, "N": 1.28962, "EG": 0.428428, "XTI": 5, "BV": 45, "IBV": 0.0002,
+				  "CJO": 1e-11, "VJ": 0.7, "M": 0.5, "FC": 0.5, "TT": 0, "KF": 0, "AF": 1 }
+
+""" Command line of the SPICE simulator, followed by the .cir file path. The environment variable SPSIM_SIMULATOR
+	replaces it (for instance by a wine call or by a local script that writes the .raw file) """
+SIMULATOR_COMMAND = shlex.split(os.environ.get("SPSIM_SIMULATOR", "scad3 -b -run"))
+
+""" Version of the stored results of the class result_cache. It is part of the key of the stored results, so it must
+	be changed whenever a modification of the simulation (cell_component_py.lib, pvsolver) changes its results """
+RESULT_CACHE_VERSION = "1"
+
+""" Version of the parameter extraction algorithm. It is part of the key of the parameters cache (class
+	parameters_cache), so it must be changed whenever a modification of gausspv changes its results """
+GAUSSPV_VERSION = "2"
+
 """ class gausspv: 
 		 	Implementation of an algorithm for estimation of the PV panel
 		equivalent circuit (one diode, with series and shunt resistances), based
@@ -26,9 +56,22 @@ import numpy as np
 					   k = Boltzmann's constant
 					   q = electron charge
 					   T = temperature (K)
-					   A = diode ideality constant  """
+					   A = diode ideality constant
+			The fixed point of the Gauss-Seidel iterations may be found with two solvers: "gauss" (the plain
+		iterations of the article, default) or "anderson" (the same iterations with Anderson acceleration, usually
+		converging in a few tens of steps). If the accelerated solver fails it falls back to "gauss". After the
+		routine, "residual" has the last relative residual, "history" the residual of every iteration,
+		"iterations" the number of iterations and "fallback" tells if the accelerated solver failed. After a
+		fallback these are the values of the "gauss" iterations, and "anderson_iterations" has the number of
+		iterations of the failed accelerated run.
+			If a parameters_cache object is given, the fitted parameters are read from it when the same
+		datasheet was already fitted (the history is not stored), and saved on it otherwise.
+			The method get_parameters accepts a temperature or an array of temperatures. The values of each
+		temperature are kept on a LRU dictionary with at most "parameters_maxsize" entries, and the temperatures
+		may be rounded to multiples of "temp_step" degrees (around the standard temperature) to improve the
+		reuse. The lookups are counted on "parameters_hits" and "parameters_misses".  """
 class gausspv:
-	def __init__(self,Voc,Isc,Vmp,Imp,Kv,Ki,Ns,stdtemp):	#All the input values must be STC datasheet values
+	def __init__(self,Voc,Isc,Vmp,Imp,Kv,Ki,Ns,stdtemp,solver="gauss",cache=None,temp_step=None,parameters_maxsize=1024):	#All the input values must be STC datasheet values
 		#Physical constants
 		self.k = 1.38064852e-23		#Boltzmann constant
 		self.q = 1.60217662e-19		#Electron charge
@@ -45,9 +88,18 @@ class gausspv:
 		self.Ns   = Ns
 		self.stdtemp = stdtemp + self.kelvin
 		self.stdtempC = stdtemp
+		self.solver = solver
+		self.cache = cache
+
+		#Temperature parameters dictionary
+		self.temp_step = temp_step
+		self.parameters_maxsize = parameters_maxsize
+		self.parameters_hits = 0
+		self.parameters_misses = 0
+		self.parameters_dic = OrderedDict()
 
 		#Execution of the routine to calculate the parameters
-		self.routine()
+		self.routineCached()
 
 	def manualSetting(self,I0,Iph,Rs,Rsh,A):			#function used to set the values manually
 		self.I0 = I0
@@ -56,18 +108,20 @@ class gausspv:
 		self.Rsh = Rsh
 		self.Rsh2 = Rsh
 		self.Vt = A*self.k*self.stdtemp/self.q
-		self.parameters_dic = {}
+		self.parameters_dic = OrderedDict()
 
 	def calcExpression(self,V,I):
 		I2 = self.Iph - self.I0*( np.exp((V+I*self.Rs)/(self.Ns*self.Vt)) - 1 ) - (V + I*self.Rs)/(self.Rsh)
 		return I2
 
-	def iterVt(self,Voc,Isc,Vmp,Imp,Rs,Rsh,Ns):			#evaluation of expression (20)
-		try:
-			ln2 = np.log( (Isc*Rsh + Isc*Rs - Voc - Vmp - Imp*Rs - Imp*Rsh)/(Isc*Rsh + Isc*Rs - Voc) )
-			Vt2 = ( Vmp + Imp*Rs - Voc )/( Ns*ln2 )
-		except:
-			Vt2 = 0.032
+	def iterVt(self,Voc,Isc,Vmp,Imp,Rs,Rsh,Ns):			#evaluation of expression (20), 0.032 is used only on divisions by zero
+		d1 = Isc*Rsh + Isc*Rs - Voc
+		if d1 == 0:
+			return 0.032
+		ln2 = np.log( (Isc*Rsh + Isc*Rs - Voc - Vmp - Imp*Rs - Imp*Rsh)/d1 )
+		if Ns*ln2 == 0:
+			return 0.032
+		Vt2 = ( Vmp + Imp*Rs - Voc )/( Ns*ln2 )
 		return Vt2
 
 	def iterRs(self,Voc,Isc,Vmp,Imp,Rs,Rsh,Ns,Vt):		#evaluation of expression (23)
@@ -96,20 +150,28 @@ class gausspv:
 		return Rsh3
 
 	def calcError(self):								#function used to determine a stop criteria
-		errorVt = (self.Vt - self.VtA)/self.Vt
-		errorRs = (self.Rs - self.RsA)/self.Rs
-		errorRsh = (self.Rsh - self.RshA)/self.Rsh
+		errorVt = abs( (self.Vt - self.VtA)/self.Vt )
+		errorRs = abs( (self.Rs - self.RsA)/self.Rs )
+		errorRsh = abs( (self.Rsh - self.RshA)/self.Rsh )
 
 		self.RsA  = self.Rs
 		self.VtA  = self.Vt
 		self.RshA = self.Rsh
 
+		self.residual = max(errorVt, errorRs, errorRsh)
+		self.history.append(self.residual)
 		if (errorVt < 0.000001) and (errorRs < 0.000001) and (errorRsh < 0.000001):
 			return True
 		else:
 			return False
 
-	def routine(self):				#iterative routine
+	def sweep(self,Rsh,Rs,Vt):		#one Gauss-Seidel iteration, the fixed point map used by all the solvers
+		Rsh = self.iterRsh(self.Voc,self.Isc,self.Vmp,self.Imp,Rs,Rsh,self.Ns,Vt)
+		Rs = self.iterRs(self.Voc,self.Isc,self.Vmp,self.Imp,Rs,Rsh,self.Ns,Vt)
+		Vt = self.iterVt(self.Voc,self.Isc,self.Vmp,self.Imp,Rs,Rsh,self.Ns)
+		return Rsh, Rs, Vt
+
+	def routine(self):				#iterative routine, runs the selected solver
 		#Parameters to be estimated:
 		self.Rs   = 0
 		self.Rsh  = 5000
@@ -117,20 +179,91 @@ class gausspv:
 		self.Io   = None
 		self.Iph  = None
 
+		#Convergence report
+		self.residual = None
+		self.history = []
+		self.iterations = 0
+		self.anderson_iterations = 0
+		self.fallback = False
+
+		#Refreshing dictionary
+		self.parameters_dic = OrderedDict()
+
+		if self.solver == "anderson":
+			if self.routineAnderson() == True:
+				return True
+			self.fallback = True		#the convergence report is the one of the Gauss-Seidel iterations
+			self.anderson_iterations = self.iterations
+			self.iterations = 0
+			self.residual = None
+			self.history = []
+		elif self.solver != "gauss":
+			raise ValueError("Unknown solver '{}', use 'gauss' or 'anderson'".format(self.solver))
+		return self.routineGauss()
+
+	#	Anderson acceleration of the Gauss-Seidel iterations: the next point is the combination of the last "depth"
+	#iterations that minimizes the residual. The variables are scaled by the first iteration, since Rsh, Rs and Vt
+	#have very different magnitudes. Returns False if it does not converge or leaves the valid region of the map
+	def routineAnderson(self,depth=3,tol=1e-10,maxiter=200):
+		with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+			x = np.array([self.Rsh, self.Rs, self.Vt], dtype=float)
+			gx = np.array(self.sweep(*x))
+			scale = np.abs(gx)
+			if not np.all(np.isfinite(gx)) or np.any(scale == 0):
+				return False
+			F, G = [], []
+			for i in range(maxiter):
+				self.iterations += 1
+				self.residual = np.max(np.abs( (gx - x)/gx ))
+				self.history.append(self.residual)
+				if self.residual < tol:
+					break
+
+				#least squares combination of the last iterations
+				F.append( (gx - x)/scale )
+				G.append( gx/scale )
+				F, G = F[-depth-1:], G[-depth-1:]
+				x2 = gx
+				if len(F) > 1:
+					dF = np.diff(F, axis=0).T
+					dG = np.diff(G, axis=0).T
+					gamma = np.linalg.lstsq(dF, F[-1], rcond=None)[0]
+					x2 = (G[-1] - dG.dot(gamma))*scale
+
+				gx2 = np.array(self.sweep(*x2))
+				if not np.all(np.isfinite(gx2)):
+					if len(F) == 1:		#even the plain iteration failed
+						return False
+					F, G = [], []		#restart from the plain iteration
+					x2 = gx
+					gx2 = np.array(self.sweep(*x2))
+					if not np.all(np.isfinite(gx2)):
+						return False
+				x, gx = x2, gx2
+			else:
+				return False
+
+		self.Rsh, self.Rs, self.Vt = [float(v) for v in gx]
+		self.I0 = self.iterI0(self.Voc,self.Isc,self.Rs,self.Rsh,self.Ns,self.Vt)
+		self.Iph = self.iterIph(self.Voc,self.Rsh,self.Ns,self.Vt,self.I0)
+		self.Rsh2 = self.iterRsh2(self.Vmp,self.Imp,self.Rs,self.Ns,self.Vt,self.I0,self.Iph,self.Pmax)
+		return True
+
+	def routineGauss(self):			#plain Gauss-Seidel iterations of the article
+		self.Rs   = 0
+		self.Rsh  = 5000
+		self.Vt   = self.iterVt(self.Voc,self.Isc,self.Vmp,self.Imp,self.Rs,self.Rsh,self.Ns)
+
 		#Initialization of convergence check variables:
 		self.RsA  = self.Rs
 		self.VtA  = self.Vt
 		self.RshA = self.Rsh
 
-		#Refreshing dictionary
-		self.parameters_dic = {}
-
 		niter = 100000
 		for i in range(niter):
 						
-			self.Rsh = self.iterRsh(self.Voc,self.Isc,self.Vmp,self.Imp,self.Rs,self.Rsh,self.Ns,self.Vt)
-			self.Rs = self.iterRs(self.Voc,self.Isc,self.Vmp,self.Imp,self.Rs,self.Rsh,self.Ns,self.Vt)
-			self.Vt = self.iterVt(self.Voc,self.Isc,self.Vmp,self.Imp,self.Rs,self.Rsh,self.Ns)
+			self.Rsh, self.Rs, self.Vt = self.sweep(self.Rsh,self.Rs,self.Vt)
+			self.iterations += 1
 
 			if self.calcError() == True:
 				self.I0 = self.iterI0(self.Voc,self.Isc,self.Rs,self.Rsh,self.Ns,self.Vt)
@@ -143,37 +276,341 @@ class gausspv:
 		self.Rsh2 = self.iterRsh2(self.Vmp,self.Imp,self.Rs,self.Ns,self.Vt,self.I0,self.Iph,self.Pmax)
 		return False
 
-	# This is the function used to retrieve the circuit parameters for any desired temperature
+	#	Same as routine, but first looks for the datasheet on the parameters cache (if there is one). The fitted values
+	#are stored on the cache after a miss
+	def routineCached(self):
+		if self.cache is None:
+			return self.routine()
+
+		key = self.cache.key(self.Voc,self.Isc,self.Vmp,self.Imp,self.Kv,self.Ki,self.Ns,self.stdtempC,self.solver)
+		entry = self.cache.get(key)
+		if entry is not None:
+			self.Rs, self.Rsh, self.Vt = entry["Rs"], entry["Rsh"], entry["Vt"]
+			self.I0, self.Iph, self.Rsh2 = entry["I0"], entry["Iph"], entry["Rsh2"]
+			self.residual, self.iterations, self.fallback = entry["residual"], entry["iterations"], entry["fallback"]
+			self.anderson_iterations = entry.get("anderson_iterations", 0)
+			self.history = []
+			self.parameters_dic = OrderedDict()
+			return entry["converged"]
+
+		converged = self.routine()
+		self.cache.put(key, { "Rs": self.Rs, "Rsh": self.Rsh, "Vt": self.Vt, "I0": self.I0, "Iph": self.Iph, "Rsh2": self.Rsh2,
+							  "residual": self.residual, "iterations": self.iterations, "fallback": self.fallback,
+							  "anderson_iterations": self.anderson_iterations,
+							  "converged": converged })
+		return converged
+
+	def calcParameters(self,temperature):		#circuit parameters for a temperature in Kelvin (scalar or array), without dictionary
+		Vt2  = self.Vt * temperature / self.stdtemp
+		Iph2 = self.Iph +  self.Ki * (temperature - self.stdtemp)
+		
+		Voc2 = self.Voc + self.Kv * (temperature - self.stdtemp)
+		Isc2 = self.Isc + self.Ki * (temperature - self.stdtemp)
+		I02 = self.iterI0(Voc2,Isc2,self.Rs,self.Rsh,self.Ns,Vt2)
+		A = Vt2*self.q/(self.k*self.stdtemp)
+
+		return [I02, Iph2, self.Rs, self.Rsh2, A]
+
+	def quantizeTemp(self,temperature):		#rounds the temperatures (Kelvin) to multiples of temp_step around stdtemp
+		if not self.temp_step:
+			return temperature
+		return self.stdtemp + np.round( (temperature - self.stdtemp)/self.temp_step )*self.temp_step
+
+	def storeParameters(self,temperature,values):	#method used to add an entry to the LRU dictionary
+		self.parameters_dic[temperature] = values
+		while len(self.parameters_dic) > self.parameters_maxsize:
+			self.parameters_dic.popitem(last=False)
+
+	#	This is the function used to retrieve the circuit parameters for any desired temperature. For an array of
+	#temperatures it returns arrays of I0, Iph, Rs, Rsh and A with the same shape (each distinct temperature is
+	#looked up once)
 	def get_parameters(self,temp):
-		temperature = temp + self.kelvin
+		temperature = self.quantizeTemp( np.asarray(temp, dtype=float) + self.kelvin )
+
+		if temperature.ndim == 0:
+			temperature = float(temperature)
+			if temperature in self.parameters_dic:
+				self.parameters_hits += 1
+				self.parameters_dic.move_to_end(temperature)
+				return self.parameters_dic[temperature]
+			self.parameters_misses += 1
+			values = self.calcParameters(temperature)
+			self.storeParameters(temperature, values)
+			return values
+
+		unique, inverse = np.unique(temperature, return_inverse=True)
+		table = np.empty((len(unique), 5))
+		missing = []
+		for i, t in enumerate(unique.tolist()):
+			if t in self.parameters_dic:
+				self.parameters_dic.move_to_end(t)
+				table[i] = self.parameters_dic[t]
+			else:
+				missing.append(i)
+		self.parameters_hits += len(unique) - len(missing)
+		self.parameters_misses += len(missing)
+		if len(missing) > 0:
+			values = np.broadcast_arrays(*self.calcParameters(unique[missing]))
+			table[missing] = np.stack(values, axis=1)
+			for i, row in zip(missing, table[missing].tolist()):
+				self.storeParameters(unique[i].item(), row)
+		return [table[:,j][inverse].reshape(temperature.shape) for j in range(5)]
+
+""" class gausspv_batch: 
+			Vectorized version of the gausspv algorithm, used to fit whole module catalogs at once. The
+		datasheet values may be NumPy arrays (or scalars, broadcast to the arrays' shape) and the Gauss-Seidel
+		iterations run on all of them at the same time. Each entry stops iterating as soon as it satisfies the
+		same stop criteria of gausspv.calcError, so the results are the same of fitting them one by one with
+		the "gauss" solver.
+			After the routine, the attributes I0, Iph, Rs, Rsh, Rsh2 and Vt are arrays with one value per
+		datasheet, "converged" tells which entries satisfied the stop criteria and "iterations" has the number
+		of iterations done by each entry. The method get_parameters returns arrays as well: the temperatures are
+		broadcast against the datasheets (all the five arrays have the broadcast shape), and only scalar
+		temperatures use the parameters dictionary.
+			Each iteration on arrays costs about ten iterations of gausspv, so catalogs with less than
+		"batch_size" datasheets are fitted one by one by gausspv instead (same results).  """
+class gausspv_batch(gausspv):
+	batch_size = 16		#smallest number of datasheets fitted on arrays, below it the scalar routine is faster
+
+	def __init__(self,Voc,Isc,Vmp,Imp,Kv,Ki,Ns,stdtemp=25.0,niter=100000):	#All the input values must be STC datasheet values
+		#Physical constants
+		self.k = 1.38064852e-23		#Boltzmann constant
+		self.q = 1.60217662e-19		#Electron charge
+		self.kelvin = 273.15		#Celsius to Kelvin
+
+		#Datasheet values
+		Voc,Isc,Vmp,Imp,Kv,Ki,Ns = np.broadcast_arrays(Voc,Isc,Vmp,Imp,Kv,Ki,Ns)
+		self.Voc  = Voc.astype(float)
+		self.Isc  = Isc.astype(float)
+		self.Vmp  = Vmp.astype(float)
+		self.Imp  = Imp.astype(float)
+		self.Kv   = Kv.astype(float)
+		self.Ki	  = Ki.astype(float)
+		self.Pmax = self.Vmp*self.Imp
+		self.Ns   = Ns.astype(int)
+		self.stdtemp = stdtemp + self.kelvin
+		self.stdtempC = stdtemp
+		self.niter = niter
+
+		#Temperature parameters dictionary
+		self.temp_step = None
+		self.parameters_maxsize = 1024
+		self.parameters_hits = 0
+		self.parameters_misses = 0
+		self.parameters_dic = OrderedDict()
+
+		#Execution of the routine to calculate the parameters
+		self.routine()
+
+	def iterVt(self,Voc,Isc,Vmp,Imp,Rs,Rsh,Ns):			#evaluation of expression (20), same fallback of gausspv.iterVt on divisions by zero
+		with np.errstate(divide='ignore', invalid='ignore'):
+			d1 = Isc*Rsh + Isc*Rs - Voc
+			ln2 = np.log( (Isc*Rsh + Isc*Rs - Voc - Vmp - Imp*Rs - Imp*Rsh)/d1 )
+			Vt2 = ( Vmp + Imp*Rs - Voc )/( Ns*ln2 )
+		return np.where( (d1 == 0) | (Ns*ln2 == 0), 0.032, Vt2 )
+
+	def routine(self):				#iterative routine, with one convergence mask per datasheet
+		if self.Voc.size < self.batch_size:
+			return self.routineScalar()
+		shape = self.Voc.shape
+		#Parameters to be estimated:
+		self.Rs   = np.zeros(shape)
+		self.Rsh  = np.full(shape, 5000.0)
+		self.Vt   = self.iterVt(self.Voc,self.Isc,self.Vmp,self.Imp,self.Rs,self.Rsh,self.Ns)
+		self.converged = np.zeros(shape, dtype=bool)
+		self.iterations = np.zeros(shape, dtype=int)
 
-		if temperature in self.parameters_dic:
-			return self.parameters_dic[temperature]
+		#Refreshing dictionary
+		self.parameters_dic = OrderedDict()
+
+		active = np.flatnonzero( np.ones(shape, dtype=bool) )
+		Voc, Isc, Vmp, Imp, Ns = self.Voc.ravel(), self.Isc.ravel(), self.Vmp.ravel(), self.Imp.ravel(), self.Ns.ravel()
+		Rs, Rsh, Vt = self.Rs.ravel(), self.Rsh.ravel(), self.Vt.ravel()
+		iterations, converged = self.iterations.ravel(), self.converged.ravel()
+		with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+			for i in range(self.niter):
+				if len(active) == 0:
+					break
+				a = active
+				RsA, RshA, VtA = Rs[a], Rsh[a], Vt[a]
+				Rsh[a] = self.iterRsh(Voc[a],Isc[a],Vmp[a],Imp[a],Rs[a],Rsh[a],Ns[a],Vt[a])
+				Rs[a] = self.iterRs(Voc[a],Isc[a],Vmp[a],Imp[a],Rs[a],Rsh[a],Ns[a],Vt[a])
+				Vt[a] = self.iterVt(Voc[a],Isc[a],Vmp[a],Imp[a],Rs[a],Rsh[a],Ns[a])
+				iterations[a] += 1
+
+				#same stop criteria of gausspv.calcError
+				errorVt = np.abs( (Vt[a] - VtA)/Vt[a] )
+				errorRs = np.abs( (Rs[a] - RsA)/Rs[a] )
+				errorRsh = np.abs( (Rsh[a] - RshA)/Rsh[a] )
+				done = (errorVt < 0.000001) & (errorRs < 0.000001) & (errorRsh < 0.000001)
+				converged[a[done]] = True
+				active = a[~done]
+
+			self.I0 = self.iterI0(self.Voc,self.Isc,self.Rs,self.Rsh,self.Ns,self.Vt)
+			self.Iph = self.iterIph(self.Voc,self.Rsh,self.Ns,self.Vt,self.I0)
+			self.Rsh2 = self.iterRsh2(self.Vmp,self.Imp,self.Rs,self.Ns,self.Vt,self.I0,self.Iph,self.Pmax)
+		return np.all(self.converged)
+
+	def routineScalar(self):		#fits the datasheets one by one with gausspv ("gauss" solver)
+		shape = self.Voc.shape
+		datasheets = zip(*[ x.ravel().tolist() for x in (self.Voc, self.Isc, self.Vmp, self.Imp, self.Kv, self.Ki, self.Ns) ])
+		fits = [ gausspv(Voc, Isc, Vmp, Imp, Kv, Ki, Ns, self.stdtempC) for Voc, Isc, Vmp, Imp, Kv, Ki, Ns in datasheets ]
+		for name in ("Rs", "Rsh", "Vt", "I0", "Iph", "Rsh2"):
+			setattr(self, name, np.array([ getattr(fit, name) for fit in fits ], dtype=float).reshape(shape))
+		self.iterations = np.array([ fit.iterations for fit in fits ], dtype=int).reshape(shape)
+		self.converged = np.array([ fit.residual < 0.000001 for fit in fits ], dtype=bool).reshape(shape)	#stop criteria of calcError
+		self.parameters_dic = OrderedDict()
+		return np.all(self.converged)
+
+	#	Each datasheet has its own values, so arrays of temperatures are not stored on the dictionary. The five values
+	#are always arrays with the shape of the temperatures broadcast against the datasheets
+	def get_parameters(self,temp):
+		if np.ndim(temp) == 0:
+			values = gausspv.get_parameters(self,temp)
 		else:
-			Vt2  = self.Vt * temperature / self.stdtemp
-			Iph2 = self.Iph +  self.Ki * (temperature - self.stdtemp)
-			
-			Voc2 = self.Voc + self.Kv * (temperature - self.stdtemp)
-			Isc2 = self.Isc + self.Ki * (temperature - self.stdtemp)
-			I02 = self.iterI0(Voc2,Isc2,self.Rs,self.Rsh,self.Ns,Vt2)
-			A = Vt2*self.q/(self.k*self.stdtemp)
-
-			self.parameters_dic[temperature] = [I02, Iph2, self.Rs, self.Rsh2, A]
-			
-			return [I02, Iph2, self.Rs, self.Rsh2, A]
+			values = self.calcParameters( self.quantizeTemp(np.asarray(temp, dtype=float) + self.kelvin) )
+		return [ np.array(value, dtype=float) for value in np.broadcast_arrays(*values) ]
+
+	#	Returns the fitted parameters at STC together with the convergence flag and the number of iterations of
+	#each datasheet: [I0, Iph, Rs, Rsh, A, converged, iterations]
+	def get_results(self):
+		I0, Iph, Rs, Rsh, A = self.get_parameters(self.stdtempC)
+		return [I0, Iph, Rs, Rsh, A, self.converged, self.iterations]
+
+""" class parameters_cache: 
+			Persistent cache of the parameters fitted by gausspv, stored as a JSON file (by default inside the
+		"workspace" folder). Each entry is addressed by a hash of the datasheet values, the standard temperature,
+		the solver and GAUSSPV_VERSION. The file is only read on the first access, holds at most "maxsize"
+		entries (the least recently used are discarded) and is rewritten atomically after each new entry, so
+		an interrupted write never corrupts it.  """
+class parameters_cache:
+	def __init__(self,filepath=os.path.join("workspace","parameters_cache.json"),maxsize=256):
+		self.filepath = filepath
+		self.maxsize = maxsize
+		self.entries = None		#loaded on the first access
+		self.hits = 0
+		self.misses = 0
+
+	def key(self,Voc,Isc,Vmp,Imp,Kv,Ki,Ns,stdtemp,solver):	#returns the key of a datasheet
+		values = [repr(float(v)) for v in (Voc,Isc,Vmp,Imp,Kv,Ki,stdtemp)] + [int(Ns), str(solver), GAUSSPV_VERSION]
+		return hashlib.sha1(json.dumps(values).encode("utf-8")).hexdigest()
+
+	def load(self):			#method used to read the cache file. A missing or damaged file is an empty cache
+		self.entries = OrderedDict()
+		try:
+			with open(self.filepath, "r") as f:
+				data = json.load(f)
+		except (OSError, ValueError):
+			return
+		if isinstance(data, dict):
+			for key, entry in data.get("entries", []):
+				self.entries[key] = entry
+
+	def save(self):			#method used to write the cache file (write on a temporary file, then replace)
+		folder = os.path.dirname(os.path.abspath(self.filepath))
+		os.makedirs(folder, exist_ok=True)
+		fd, tmppath = tempfile.mkstemp(dir=folder, prefix=".parameters_cache", suffix=".tmp")
+		try:
+			with os.fdopen(fd, "w") as f:
+				json.dump({ "version": GAUSSPV_VERSION, "entries": list(self.entries.items()) }, f)
+			os.replace(tmppath, self.filepath)
+		except BaseException:
+			os.remove(tmppath)
+			raise
+
+	def get(self,key):		#returns the entry of the key, or None if it is not on the cache
+		if self.entries is None:
+			self.load()
+		if key in self.entries:
+			self.entries.move_to_end(key)
+			self.hits += 1
+			return self.entries[key]
+		self.misses += 1
+		return None
+
+	def put(self,key,entry):	#method used to add an entry, discarding the least recently used ones
+		if self.entries is None:
+			self.load()
+		self.entries[key] = { k: (float(v) if isinstance(v, np.floating) else v) for k, v in entry.items() }
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.maxsize:
+			self.entries.popitem(last=False)
+		self.save()
+
+	def clear(self):		#method used to erase all the entries
+		self.entries = OrderedDict()
+		self.save()
+
+""" class gridstate holds the conditions of all the cells of a grid as NumPy arrays indexed by (string, module, cell):
+	temperature, irradiance, hotspot and PID flags. It also keeps the temperature and irradiance of each module and
+	the temperature of each bypass diode, indexed by (string, module, diode). The classes pvmodule and pvcell are
+	views over these arrays, so a grid does not need one Python object per cell. """
+class gridstate:
+	def __init__(self,nparallel,nserie,Ns,temperature=25.0,irradiance=1000.0):
+		shape = (nparallel, nserie, Ns)
+		self.cell_temp = np.full(shape, float(temperature))
+		self.cell_irrad = np.full(shape, float(irradiance))
+		self.cell_hotspot = np.zeros(shape, dtype=bool)
+		self.cell_pid = np.zeros(shape, dtype=bool)
+		self.module_temp = np.full(shape[:2], float(temperature))
+		self.module_irrad = np.full(shape[:2], float(irradiance))
+		self.diode_temp = np.full(shape[:2] + (0,), float(temperature))
+		self.cell_dirty = np.ones(shape, dtype=bool)	#cells changed since the last solution (see markDirty)
+
+	def setDiodeCount(self,count):		#method used to resize the bypass diodes array, each diode takes its module's temperature
+		self.diode_temp = np.repeat(self.module_temp[:,:,np.newaxis], count, axis=2)
+		self.markDirty()
+
+	#	Dirty tracking: the setters of pvgrid, pvmodule and pvcell mark the cells they change, so the native solver
+	#only solves again the strings with changed cells (see pvsolver.solve). Code that writes the arrays directly
+	#must call markDirty itself. The mask is aligned by the leading axes, as on assign (None marks all the cells)
+	def markDirty(self,mask=None):
+		gridstate.assign(self.cell_dirty, True, mask)
+
+	def dirtyModules(self):		#(string, module) flags of the modules with changed cells
+		return np.any(self.cell_dirty, axis=2)
+
+	def dirtyStrings(self):		#flags of the strings with changed cells
+		return np.any(self.cell_dirty, axis=(1,2))
+
+	def clearDirty(self,strings=None):	#method used after a solution (of all the strings, or only of the given ones)
+		if strings is None:
+			self.cell_dirty[...] = False
+		else:
+			self.cell_dirty[strings] = False
+
+	#	Writes "values" on the array "target" (only where "mask" is True, if given). The values and the mask may have
+	#fewer dimensions than the target: they are aligned by the leading axes, so an array with one value per string,
+	#per module or per cell (or a scalar, for all of them) is accepted
+	@staticmethod
+	def assign(target,values,mask=None):
+		values = np.asarray(values)
+		if values.ndim > target.ndim or values.shape != target.shape[:values.ndim]:
+			raise ValueError("Values of shape {} do not match the grid shape {}".format(values.shape, target.shape))
+		values = values.reshape(values.shape + (1,)*(target.ndim - values.ndim))
+		if mask is None:
+			target[...] = values
+			return
+		mask = np.asarray(mask, dtype=bool)
+		if mask.ndim > target.ndim or mask.shape != target.shape[:mask.ndim]:
+			raise ValueError("Mask of shape {} does not match the grid shape {}".format(mask.shape, target.shape))
+		mask = mask.reshape(mask.shape + (1,)*(target.ndim - mask.ndim))
+		np.copyto(target, values, where=mask)
 
 """ class pvcell is the class that represents each cell. It has its own temperature and irradiance,
 	problems (hotspot, PID), reference number (number within module, module's number, string's number),
-	positive and negative nodes. """
+	positive and negative nodes. The conditions are stored on a gridstate object (the one of its grid,
+	or a new one for a standalone cell). """
 class pvcell:
-	def __init__(self,param_source,row,column,number):
+	def __init__(self,param_source,row,column,number,state=None,index=None):
 		#Cell parameters
 		self.parameters = param_source
-		self.temperature = self.parameters.stdtempC
-		self.irradiance = 1000.0
 		self.Ns = self.parameters.Ns
-		self.hotspot = False
-		self.piddefect = False
+		if state is None:
+			state = gridstate(1,1,1,self.parameters.stdtempC)
+			index = (0,0,0)
+		self.state = state
+		self.index = index
 
 		#Circuit references
 		self.row = row
@@ -183,125 +620,257 @@ class pvcell:
 		self.node1 = "S{}P{}N{}".format(self.row, self.column, self.number + 1)
 		self.cell_name = "S{}P{}N{}".format(self.row, self.column, self.number)
 
+	@property
+	def temperature(self):
+		return float(self.state.cell_temp[self.index])
+
+	@temperature.setter
+	def temperature(self,value):
+		self.state.cell_temp[self.index] = value
+		self.state.cell_dirty[self.index] = True
+
+	@property
+	def irradiance(self):
+		return float(self.state.cell_irrad[self.index])
+
+	@irradiance.setter
+	def irradiance(self,value):
+		self.state.cell_irrad[self.index] = value
+		self.state.cell_dirty[self.index] = True
+
+	@property
+	def hotspot(self):
+		return bool(self.state.cell_hotspot[self.index])
+
+	@hotspot.setter
+	def hotspot(self,value):
+		self.state.cell_hotspot[self.index] = value
+		self.state.cell_dirty[self.index] = True
+
+	@property
+	def piddefect(self):
+		return bool(self.state.cell_pid[self.index])
+
+	@piddefect.setter
+	def piddefect(self,value):
+		self.state.cell_pid[self.index] = value
+		self.state.cell_dirty[self.index] = True
+
 	def changeCellTemp(self,new_temp):		#method used to change the cell temperature
 		self.temperature = new_temp
 
-	def writeCommandLine(self):				#method used to obtain the SPICE equivalent circuit with the cell's conditions
-		self.I0, self.Iph, Rs, Rsh, self.A = self.parameters.get_parameters(self.temperature) # <-- usage of the "get_parameters" method
-		self.Rs = Rs / self.Ns
-		self.Rsh = Rsh / self.Ns
-		cellcircuit = ( "xcell{cellname} {node0} {node1} cell_py params: irrad={irrad} i0={i0} iph={iph} rs={rs} rsh={rsh} a={a} ktq={ktq} ns={ns}".format(
-					cellname = self.cell_name,
-					node0 = self.node0,
-					node1 = self.node1,
-					irrad = self.irradiance,
-					i0 = self.I0,
-					iph = self.Iph,
-					rs = self.Rs,
-					rsh = self.Rsh,
-					a = self.A,
+	#	Returns the SPICE line of a cell and the values written on it. Used by writeCommandLine and by the modules,
+	#which write their cells straight from the gridstate arrays
+	@staticmethod
+	def commandLine(parameters,cell_name,node0,node1,temperature,irradiance):
+		I0, Iph, Rs, Rsh, A = parameters.get_parameters(temperature) # <-- usage of the "get_parameters" method
+		Rs = Rs / parameters.Ns
+		Rsh = Rsh / parameters.Ns
+		cellcircuit = pvcell.formatLine(cell_name,node0,node1,irradiance,I0,Iph,Rs,Rsh,A)
+		return cellcircuit, I0, Iph, Rs, Rsh, A
+
+	@staticmethod
+	def formatLine(cell_name,node0,node1,irrad,i0,iph,rs,rsh,a):	#the values may also be SPICE expressions, such as "{irrad_g0}"
+		return ( "xcell{cellname} {node0} {node1} cell_py params: irrad={irrad} i0={i0} iph={iph} rs={rs} rsh={rsh} a={a} ktq={ktq} ns={ns}".format(
+					cellname = cell_name,
+					node0 = node0,
+					node1 = node1,
+					irrad = irrad,
+					i0 = i0,
+					iph = iph,
+					rs = rs,
+					rsh = rsh,
+					a = a,
 					ktq = 1.0,
 					ns = 1.0 ) )
+
+	def writeCommandLine(self):				#method used to obtain the SPICE equivalent circuit with the cell's conditions
+		cellcircuit, self.I0, self.Iph, self.Rs, self.Rsh, self.A = self.commandLine(self.parameters, self.cell_name,
+							self.node0, self.node1, self.temperature, self.irradiance)
 		return cellcircuit
 
 """ class pvmodule is the class that represents each module. It has its own reference number 
 	(module's number, string's number), positive and negative nodes, list of bypass diode, list
 	of bypass diode's temperature and a list containing its cells. Note that it has a reference
-	temperature	and irradiance, although each cell may have its individual values. """
+	temperature	and irradiance, although each cell may have its individual values. These values
+	are stored on a gridstate object and the cells (views over it) are only created when "cells" is used. """
 class pvmodule:
-	def __init__(self,param_source,row,column):
+	def __init__(self,param_source,row,column,state=None,index=None):
 		self.parameters = param_source
 		self.row = row
 		self.column = column
-		self.cells = []
-		self.temperature = self.parameters.stdtempC
-		self.irradiance = 1000.0
+		if state is None:
+			state = gridstate(1,1,self.parameters.Ns,self.parameters.stdtempC)
+			index = (0,0)
+		self.state = state
+		self.index = index
 		self.diode_list = None
-		self.diode_temp = []
-
-		#Creating the module's cells
-		for i in range(self.parameters.Ns):
-			self.cells.append(pvcell(self.parameters,self.row,self.column,i))
+		self.cell_views = None
 
 		self.node0 = None
 		self.node1 = None
 
+	@property
+	def cells(self):		#list of pvcell views, created on the first use
+		if self.cell_views is None:
+			self.cell_views = [ pvcell(self.parameters,self.row,self.column,i,self.state,self.index + (i,)) for i in range(self.parameters.Ns) ]
+			if self.node0 is not None:
+				self.cell_views[0].node0 = self.node0
+			if self.node1 is not None:
+				self.cell_views[-1].node1 = self.node1
+		return self.cell_views
+
+	@property
+	def temperature(self):
+		return float(self.state.module_temp[self.index])
+
+	@temperature.setter
+	def temperature(self,value):
+		self.state.module_temp[self.index] = value
+
+	@property
+	def irradiance(self):
+		return float(self.state.module_irrad[self.index])
+
+	@irradiance.setter
+	def irradiance(self,value):
+		self.state.module_irrad[self.index] = value
+
+	@property
+	def diode_temp(self):		#read-only array view, one temperature per bypass diode (see setDiodeTemp)
+		view = self.state.diode_temp[self.index]
+		view.flags.writeable = False
+		return view
+
+	def setDiodeTemp(self,num,new_temp):	#method used to change the temperature of the bypass diode "num"
+		self.state.diode_temp[self.index + (num,)] = new_temp
+		self.state.cell_dirty[self.index] = True
+
+	def cellNode0(self,i):			#first node of the cell i
+		if i == 0 and self.node0 is not None:
+			return self.node0
+		return "S{}P{}N{}".format(self.row, self.column, i)
+
+	def cellNode1(self,i):			#second node of the cell i
+		if i == self.parameters.Ns - 1 and self.node1 is not None:
+			return self.node1
+		return "S{}P{}N{}".format(self.row, self.column, i + 1)
+
 	def set_node0(self,n0):			#method used to set the first node of the module
-		self.cells[0].node0 = n0
+		if self.cell_views is not None:
+			self.cell_views[0].node0 = n0
 		self.node0 = n0
 
 	def set_node1(self,n1):			#method used to set the second node of the module
-		self.cells[-1].node1 = n1
+		if self.cell_views is not None:
+			self.cell_views[-1].node1 = n1
 		self.node1 = n1
 
 	def changeModuleTemp(self,new_temp):	#method used to set the module's temperature (and its bypasses and cells)
 		self.temperature = new_temp
-		for cell in self.cells:
-			cell.changeCellTemp(new_temp)
-		for i in range(len(self.diode_temp)):
-			self.diode_temp[i] = new_temp  
+		self.state.cell_temp[self.index] = new_temp
+		self.state.diode_temp[self.index] = new_temp
+		self.state.cell_dirty[self.index] = True
 
 	def changeModuleIrrad(self,new_irrad):	#method used to set the module's irradiance	(changing all its cells)
 		self.irradiance = new_irrad
-		for cell in self.cells:
-			cell.irradiance = new_irrad
+		self.state.cell_irrad[self.index] = new_irrad
+		self.state.cell_dirty[self.index] = True
 
-	def writeDiodeCircuit(self,probebypass):	#method used to write the bypass diode spice circuit
-		if self.diode_list == None or len(self.diode_list) != len(self.cells):
+	def bypassSegments(self):		#method that returns the (first cell, last cell) pairs covered by each bypass diode
+		if self.diode_list == None or len(self.diode_list) != self.parameters.Ns:
 			return []
-		else:
-			diode_circuit = []
-			i = 0
-			num = 0
-			node_a = None
-			node_b = None
-			for diode in self.diode_list:
-				if diode[0]>0:
-					node_a = i
-				if diode[1]>0:
-					node_b = i
-					new_line = "dbypass_S{row}P{column}N{number} {node0} {node1} Dbypass temp={diodetemp}".format(
-						number = num,
-						column = self.column,
-						row = self.row,
-						node0  = self.cells[node_a].node0,
-						node1  = self.cells[node_b].node1,
-						diodetemp = self.diode_temp[num] )
-					diode_circuit.append(new_line)
-					if probebypass:
-						probe_line = ".probe I(dbypass_S{}P{}N{})".format(self.row,self.column,num)
-						diode_circuit.append(probe_line)
-					num = num + 1
-				i = i + 1
-			return diode_circuit
+		segments = []
+		node_a = None
+		for i, diode in enumerate(self.diode_list):
+			if diode[0]>0:
+				node_a = i
+			if diode[1]>0:
+				segments.append( (node_a, i) )
+		return segments
+
+	#	Method used to write the bypass diode spice circuit. "temps" are the temperatures of the diodes, which may also be
+	#SPICE expressions such as "{td0}" (the module's ones by default)
+	def writeDiodeCircuit(self,probebypass,temps=None):
+		if temps is None:
+			temps = [ float(temp) for temp in self.diode_temp ]
+		diode_circuit = []
+		for num, (node_a, node_b) in enumerate(self.bypassSegments()):
+			new_line = "dbypass_S{row}P{column}N{number} {node0} {node1} Dbypass temp={diodetemp}".format(
+				number = num,
+				column = self.column,
+				row = self.row,
+				node0  = self.cellNode0(node_a),
+				node1  = self.cellNode1(node_b),
+				diodetemp = temps[num] )
+			diode_circuit.append(new_line)
+			if probebypass:
+				probe_line = ".probe I(dbypass_S{}P{}N{})".format(self.row,self.column,num)
+				diode_circuit.append(probe_line)
+		return diode_circuit
 	
-	def writeModuleCircuit(self,probebypass):  	#	  Method used to obtain the module's spice circuit. Note that this function 
-		modulecircuit = []						#	basically calls the method "writeCommandLine(self)" for each of its cells
-		for cell in self.cells:					#	and adds the bypass diodes
-			modulecircuit.append( cell.writeCommandLine() )
-		modulecircuit = modulecircuit + self.writeDiodeCircuit(probebypass)
-		return modulecircuit
+	def iterModuleCircuit(self,probebypass):  	#	  Generator of the module's spice circuit. Note that this function writes
+		temp = self.state.cell_temp[self.index].tolist()	#	the line of each of its cells (see pvcell.commandLine) straight
+		irrad = self.state.cell_irrad[self.index].tolist()	#	from the gridstate arrays and adds the bypass diodes
+		for i in range(self.parameters.Ns):
+			cell_name = "S{}P{}N{}".format(self.row, self.column, i)
+			yield pvcell.commandLine(self.parameters, cell_name, self.cellNode0(i), self.cellNode1(i), temp[i], irrad[i])[0]
+		for line in self.writeDiodeCircuit(probebypass):
+			yield line
+
+	def writeModuleCircuit(self,probebypass):	#method used to obtain the module's spice circuit as a list
+		return list(self.iterModuleCircuit(probebypass))
+
+	def subcircuitPorts(self):		#cell nodes (0 to Ns) that must be reachable from outside the module's subcircuit
+		ports = set([0, self.parameters.Ns])
+		for node_a, node_b in self.bypassSegments():
+			ports.add(node_a)
+			ports.add(node_b + 1)
+		return sorted(ports)
+
+	def stateKey(self):				#key that identifies modules with the same subcircuit (cell conditions and ports)
+		return ( self.state.cell_temp[self.index].tobytes(), self.state.cell_irrad[self.index].tobytes(), tuple(self.subcircuitPorts()) )
+
+	#	Method used to write the module's cells as a subcircuit definition. The bypass diodes are not part of it, so
+	#they keep their names (and probes) when the module is instantiated
+	def writeSubcircuit(self,name):
+		ports = self.subcircuitPorts()
+		subcircuit = [ ".subckt {} {}".format(name, " ".join("N{}".format(i) for i in ports)) ]
+		temp = self.state.cell_temp[self.index].tolist()
+		irrad = self.state.cell_irrad[self.index].tolist()
+		for i in range(self.parameters.Ns):
+			subcircuit.append( pvcell.commandLine(self.parameters, "N{}".format(i), "N{}".format(i), "N{}".format(i + 1), temp[i], irrad[i])[0] )
+		subcircuit.append(".ends {}".format(name))
+		return subcircuit
+
+	def writeInstanceCircuit(self,name,probebypass):	#instance of the subcircuit "name" with the module's nodes, and its bypass diodes
+		nodes = [ self.cellNode0(i) if i < self.parameters.Ns else self.cellNode1(i - 1) for i in self.subcircuitPorts() ]
+		instance = "xmodS{}P{} {} {}".format(self.row, self.column, " ".join(nodes), name)
+		return [instance] + self.writeDiodeCircuit(probebypass)
 
 
 """ class pvgrid is the class that represents the whole PV system. It has its own reference temperature and irradiance,
 	a list of modules, the number of modules in parallel and in series. It also initializes the parameters object from 
-	the	"gausspv" class. It always initializes on the STC (25°C 1000W/m^2) """
+	the	"gausspv" class, fitted with the "gauss" solver by default (and read from the parameters cache, if given). It always initializes on the STC (25°C 1000W/m^2).
+	The conditions of all the cells, modules and bypass diodes are kept on the gridstate object "state". """
 class pvgrid:
-	def __init__(self,nserie,nparallel,Voc,Isc,Vmp,Imp,Kv,Ki,Ns):
+	def __init__(self,nserie,nparallel,Voc,Isc,Vmp,Imp,Kv,Ki,Ns,solver="gauss",cache=None):
 		self.nserie = nserie
 		self.nparallel = nparallel
 		self.modules = []
+		self.solution = None		#last solution of the native solver (see pvsolver.solve)
+		self.operating_points = None	#last operating points of the native solver (see pvsolver.operatingPoints)
 		self.irradiance = 1000.0
 		self.temperature = 25.0
 
-		self.parameters = gausspv(Voc,Isc,Vmp,Imp,Kv,Ki,Ns,self.temperature)
-
+		self.parameters = gausspv(Voc,Isc,Vmp,Imp,Kv,Ki,Ns,self.temperature,solver,cache)
+		self.state = gridstate(nparallel,nserie,Ns,self.temperature,self.irradiance)
 
 		#Creating the grid's modules
 		for i in range(self.nparallel):
 			self.modules.append([])
 			for j in range(self.nserie):
-				self.modules[i].append(pvmodule(self.parameters,i,j))
+				self.modules[i].append(pvmodule(self.parameters,i,j,self.state,(i,j)))
 
 		#Setting the correct nodes
 		for i in range(nparallel):
@@ -316,15 +885,57 @@ class pvgrid:
 
 	def changeGridTemp(self,temp):		#method used to change the grid temperature (including panels and its cells)
 		self.temperature = temp 
-		for string in self.modules:
-			for module in string:
-				module.changeModuleTemp(temp)
+		self.setModuleTemp(temp)
 
 	def changeGridIrrad(self,new_irrad):	#method used to change the grid irradiance (including panels and its cells)
 		self.irradiance = new_irrad 
-		for string in self.modules:
-			for module in string:
-				module.changeModuleIrrad(new_irrad)
+		self.setModuleIrrad(new_irrad)
+
+	#	Bulk setters. "values" may be a scalar (whole grid) or an array with one value per string (nparallel), per
+	#module (nparallel x nserie), per cell (nparallel x nserie x Ns) or per bypass diode (nparallel x nserie x diodes).
+	#The optional boolean "mask" (with the same kind of shapes) selects where the values are written
+	def setCellTemp(self,values,mask=None):		#cells temperature only
+		gridstate.assign(self.state.cell_temp, values, mask)
+		self.state.markDirty(mask)
+
+	def setCellIrrad(self,values,mask=None):	#cells irradiance only
+		gridstate.assign(self.state.cell_irrad, values, mask)
+		self.state.markDirty(mask)
+
+	def setCellHotspot(self,values,mask=None):	#cells hotspot flags
+		gridstate.assign(self.state.cell_hotspot, values, mask)
+		self.state.markDirty(mask)
+
+	def setCellPID(self,values,mask=None):		#cells PID defect flags
+		gridstate.assign(self.state.cell_pid, values, mask)
+		self.state.markDirty(mask)
+
+	def setModuleTemp(self,values,mask=None):	#same as pvmodule.changeModuleTemp on the selected modules (module, cells and bypass diodes)
+		values = np.asarray(values, dtype=float)
+		if values.ndim > 2:
+			raise ValueError("Module temperatures must have at most 2 dimensions (string, module)")
+		if mask is not None and np.ndim(mask) > 2:
+			raise ValueError("Module mask must have at most 2 dimensions (string, module)")
+		gridstate.assign(self.state.module_temp, values, mask)
+		gridstate.assign(self.state.cell_temp, values, mask)
+		gridstate.assign(self.state.diode_temp, values, mask)
+		self.state.markDirty(mask)
+
+	def setModuleIrrad(self,values,mask=None):	#same as pvmodule.changeModuleIrrad on the selected modules (module and cells)
+		values = np.asarray(values, dtype=float)
+		if values.ndim > 2:
+			raise ValueError("Module irradiances must have at most 2 dimensions (string, module)")
+		if mask is not None and np.ndim(mask) > 2:
+			raise ValueError("Module mask must have at most 2 dimensions (string, module)")
+		gridstate.assign(self.state.module_irrad, values, mask)
+		gridstate.assign(self.state.cell_irrad, values, mask)
+		self.state.markDirty(mask)
+
+	def setDiodeTemp(self,values,mask=None):	#bypass diodes temperature
+		gridstate.assign(self.state.diode_temp, values, mask)
+		if mask is not None and np.ndim(mask) == 3:		#per diode mask: the modules of the selected diodes
+			mask = np.any(mask, axis=2)
+		self.state.markDirty(mask)
 
 	def setBypassList(self, diodelist):	#method used to set the bypass list of all the grid's modules
 		count = 0
@@ -334,28 +945,158 @@ class pvgrid:
 		diodecount = int(count / 2)
 
 		self.diode_list = diodelist
+		self.state.setDiodeCount(diodecount)
 		for string in self.modules:
 			for module in string:
 				module.diode_list = diodelist
-				module.diode_temp.clear()
-				for i in range(diodecount):
-					module.diode_temp.append(module.temperature)
 
-	def writeAllComponents(self,probebypass,probestrings):  #method that returns the spice circuit of the whole grid
-		components = []		#Initializing the output circuit text
+	#	Applies the conditions of a dictionary with the optional keys "temperature" and "irradiance" (per module, see
+	#setModuleTemp), "cell_temperature", "cell_irradiance" (per cell) and "diode_temperature" (per bypass diode)
+	def setConditions(self,conditions):
+		if "temperature" in conditions:
+			self.setModuleTemp(conditions["temperature"])
+		if "irradiance" in conditions:
+			self.setModuleIrrad(conditions["irradiance"])
+		if "cell_temperature" in conditions:
+			self.setCellTemp(conditions["cell_temperature"])
+		if "cell_irradiance" in conditions:
+			self.setCellIrrad(conditions["cell_irradiance"])
+		if "diode_temperature" in conditions:
+			self.setDiodeTemp(conditions["diode_temperature"])
+
+	#	Returns the voltage, current and power of the global maximum power point, found by the native solver without
+	#the whole curve (see pvsolver.globalMpp). xtol is the tolerance of the voltage
+	def find_global_mpp(self,solver=None,xtol=1e-3):
+		if solver is None:
+			solver = pvsolver()
+		return solver.globalMpp(self,xtol)
+
+	def iterStringProbe(self,idx,probestrings):	#small series resistance used to probe the string current
+		yield "rprobe_S{string} {node0} {node1} 0.000001".format(
+				string= idx,
+				node0= 0,
+				node1= self.modules[idx][0].node0)
+		if probestrings:
+			yield ".probe I(rprobe_S{})".format(idx)
+
+	def iterAllComponents(self,probebypass,probestrings):	#generator of the spice circuit of the whole grid, line by line
 		for idx, string in enumerate(self.modules):
-		#Adding a small series resistance to be able to probe the strings current			
-			components.append("rprobe_S{string} {node0} {node1} 0.000001".format(
-					string= idx,
-					node0= 0,
-					node1= self.modules[idx][0].node0) )
-			if probestrings:
-				components.append(".probe I(rprobe_S{})".format(idx))
+			for line in self.iterStringProbe(idx,probestrings):
+				yield line
 		#Writing for each module the correspondent circuit text
 			for module in string:		
-				components = components + module.writeModuleCircuit(probebypass)
-			components.append("")
-		return components
+				for line in module.iterModuleCircuit(probebypass):
+					yield line
+			yield ""
+
+	def writeAllComponents(self,probebypass,probestrings):  #method that returns the spice circuit of the whole grid
+		return list(self.iterAllComponents(probebypass,probestrings))
+
+	#	Hierarchical version of iterAllComponents: each distinct module (cell conditions and bypass layout) is defined
+	#once as a subcircuit and all the modules are instances of them. The node names, bypass diodes and probes are
+	#the same of the flat circuit
+	def iterHierarchicalComponents(self,probebypass,probestrings):
+		names = {}
+		module_names = []
+		for string in self.modules:
+			for module in string:
+				key = module.stateKey()
+				if key not in names:
+					names[key] = "pvmodule{}".format(len(names))
+					for line in module.writeSubcircuit(names[key]):
+						yield line
+					yield ""
+				module_names.append(names[key])
+		module_names = iter(module_names)
+		for idx, string in enumerate(self.modules):
+			for line in self.iterStringProbe(idx,probestrings):
+				yield line
+			for module in string:
+				for line in module.writeInstanceCircuit(next(module_names), probebypass):
+					yield line
+			yield ""
+
+	def writeHierarchicalComponents(self,probebypass,probestrings):	#method that returns the hierarchical circuit as a list
+		return list(self.iterHierarchicalComponents(probebypass,probestrings))
+
+	#	Returns the cell temperatures, cell irradiances and diode temperatures of each scenario, as arrays with the
+	#scenario as first axis. Each scenario is a dictionary with the optional keys "temperature", "irradiance" and
+	#"diode_temp", with values accepted by the bulk setters (scalar, or per string, module, cell or diode) that are
+	#applied over the current conditions of the grid
+	def scenarioArrays(self,scenarios):
+		temp = np.repeat(self.state.cell_temp[np.newaxis], len(scenarios), axis=0)
+		irrad = np.repeat(self.state.cell_irrad[np.newaxis], len(scenarios), axis=0)
+		diode_temp = np.repeat(self.state.diode_temp[np.newaxis], len(scenarios), axis=0)
+		for k, scenario in enumerate(scenarios):
+			if "temperature" in scenario:
+				gridstate.assign(temp[k], scenario["temperature"])
+			if "irradiance" in scenario:
+				gridstate.assign(irrad[k], scenario["irradiance"])
+			if "diode_temp" in scenario:
+				gridstate.assign(diode_temp[k], scenario["diode_temp"])
+		return temp, irrad, diode_temp
+
+	#	Version of iterAllComponents for .step simulations: the parameter "run" is stepped over the scenarios and the
+	#cells (and bypass diodes) whose conditions change between scenarios take their values from .param tables of
+	#"run". Cells with the same values on all the scenarios share the same parameters
+	def iterSteppedComponents(self,probebypass,probestrings,scenarios):
+		temp, irrad, diode_temp = self.scenarioArrays(scenarios)
+		nsc = len(scenarios)
+		Ns = self.parameters.Ns
+		I0, Iph, Rs, Rsh, A = self.parameters.get_parameters(temp)
+		Rs = Rs / Ns
+		Rsh = Rsh / Ns
+
+		def table(name,values):		#.param line with the value of each scenario
+			return ".param {}=table(run,{})".format(name, ",".join( "{},{}".format(k, v) for k, v in enumerate(values) ))
+
+		#Groups of cells with the same conditions on all the scenarios (cells that never change are written as constants)
+		cell_temp = temp.reshape(nsc, -1)
+		cell_irrad = irrad.reshape(nsc, -1)
+		cell_values = np.concatenate( (cell_temp, cell_irrad) ).T
+		varying = np.any(cell_temp != cell_temp[:1], axis=0) | np.any(cell_irrad != cell_irrad[:1], axis=0)
+		unique, first, cell_group = np.unique(cell_values, axis=0, return_index=True, return_inverse=True)
+		cell_group = cell_group.reshape(-1)
+		flat = lambda x: x.reshape(nsc, -1)
+		group_names = {}
+		for g, cell in enumerate(first):
+			if varying[cell]:
+				group_names[g] = "g{}".format(len(group_names))
+				for name, values in (("irrad", flat(irrad)), ("i0", flat(I0)), ("iph", flat(Iph)), ("a", flat(A))):
+					yield table( "{}_{}".format(name, group_names[g]), values[:, cell].tolist() )
+
+		#Bypass diodes whose temperature changes
+		diode_values = diode_temp.reshape(nsc, -1).T
+		diode_varying = np.any(diode_values != diode_values[:, :1], axis=1)
+		diode_names = {}
+		for d in np.flatnonzero(diode_varying):
+			diode_names[d] = "td{}".format(len(diode_names))
+			yield table( diode_names[d], diode_values[d].tolist() )
+		yield ""
+
+		ndiodes = diode_temp.shape[3]
+		for idx, string in enumerate(self.modules):
+			for line in self.iterStringProbe(idx,probestrings):
+				yield line
+			for module in string:
+				base = (idx*self.nserie + module.column)*Ns
+				for i in range(Ns):
+					cell = base + i
+					cell_name = "S{}P{}N{}".format(module.row, module.column, i)
+					g = cell_group[cell]
+					if g in group_names:
+						name = group_names[g]
+						values = ( "{{irrad_{}}}".format(name), "{{i0_{}}}".format(name), "{{iph_{}}}".format(name), "{{a_{}}}".format(name) )
+					else:
+						values = ( irrad[0].flat[cell], I0[0].flat[cell], Iph[0].flat[cell], A[0].flat[cell] )
+					yield pvcell.formatLine( cell_name, module.cellNode0(i), module.cellNode1(i), values[0], values[1], values[2],
+										Rs[0].flat[cell], Rsh[0].flat[cell], values[3] )
+				first = (idx*self.nserie + module.column)*ndiodes
+				temps = [ "{{{}}}".format(diode_names[first + num]) if first + num in diode_names else float(diode_values[first + num, 0])
+						  for num in range(len(module.bypassSegments())) ]
+				for line in module.writeDiodeCircuit(probebypass,temps):
+					yield line
+			yield ""
 
 
 """ This is the class that implements a netlist object, which contains the SPICE circuit that will be simulated.
@@ -377,11 +1118,11 @@ class netlist:
 		self.component = []
 		self.dcommands = []
 
-	def addComponent(self,comp):
+	def addComponent(self,comp):		#adds a line, or all the lines of a list (or any other iterable)
 		if type(comp) == type(" "):
 			self.component.append(comp)
-		if type(comp) == type([" "]):
-			self.component = self.component + comp
+		else:
+			self.component.extend(comp)
 
 	def addDotCommand(self,command,*argv):
 		self.dcommands.append( ".{}".format(command) )
@@ -395,34 +1136,89 @@ class netlist:
 	def clearDotCommand(self):
 		self.dcommands = []
 
+	def iterNetlist(self,components=None):	#generator of the netlist lines (the stored components, or the given iterable)
+		if components is None:
+			components = self.component
+		return chain(self.reader, [""], components, [""], self.dcommands, [".end"])
+
 	def buildNetlist(self):
-		list1 = self.reader + [""] + self.component + [""] + self.dcommands
-		list1.append(".end")
-		return list1
+		return list(self.iterNetlist())
 
-	def defaultRun(self,grid,upperv,precision, probe_strings=True, probe_bypassdiode=True):
+	def writeFile(self,f,lines):		#writes the lines on the file object f (its buffer groups the writes)
+		f.writelines( line + "\n" for line in lines )
+
+	#	The option "hierarchical" writes each distinct module once as a subcircuit (see pvgrid.iterHierarchicalComponents),
+	#which makes the netlist size depend on the number of distinct modules instead of the number of cells.
+	#	The option "scenarios" (a list of dictionaries, see pvgrid.scenarioArrays) writes a single netlist that simulates
+	#all the scenarios with ".step param run": the output .raw file has one step per scenario (see extract_raw_file.get_step)
+	def defaultRun(self,grid,upperv,precision, probe_strings=True, probe_bypassdiode=True, hierarchical=False, scenarios=None):
 		self.clearComponent()
+		self.addComponent(self.iterDefaultComponents(grid, probe_strings, probe_bypassdiode, hierarchical, scenarios))
+		self.setDefaultCommands(upperv, precision, scenarios)
+
+		txt = self.buildNetlist()
+		return txt
+
+	#	Streaming version of defaultRun: the lines are written on the file object f as they are generated, without
+	#keeping the circuit in memory
+	def writeNetlist(self,f,grid,upperv,precision, probe_strings=True, probe_bypassdiode=True, hierarchical=False, scenarios=None):
+		self.writeFile(f, self.iterDefaultNetlist(grid, upperv, precision, probe_strings, probe_bypassdiode, hierarchical, scenarios))
+
+	#	Generator of the lines of the default simulation (same lines of defaultRun, without keeping them). It is also used
+	#to get the key of the simulation on the result_cache without writing the netlist
+	def iterDefaultNetlist(self,grid,upperv,precision, probe_strings=True, probe_bypassdiode=True, hierarchical=False, scenarios=None, lowerv=0):
+		self.clearComponent()
+		self.setDefaultCommands(upperv, precision, scenarios, lowerv)
+		return self.iterNetlist(self.iterDefaultComponents(grid, probe_strings, probe_bypassdiode, hierarchical, scenarios))
+
+	#	Generator of the lines of a sweep made of (start, stop, step) segments (see jobrunner.adaptiveRun). A single .dc
+	#command is stepped over the segments with ".step param seg" and takes the limits of each segment from .param
+	#tables of "seg", so all the segments are simulated by one run of the simulator
+	def iterSegmentsNetlist(self,grid,segments, probe_strings=True, probe_bypassdiode=True, hierarchical=False):
+		self.clearComponent()
+		if len(segments) == 1:
+			start, stop, step = segments[0]
+			self.setDefaultCommands(stop, step, lowerv=start)
+		else:
+			self.setDefaultCommands("{seg_stop}", "{seg_step}", lowerv="{seg_start}")
+			for k, name in enumerate(("seg_start", "seg_stop", "seg_step")):
+				values = ",".join( "{},{}".format(i, float(segment[k])) for i, segment in enumerate(segments) )
+				self.addDotCommand("param", "{}=table(seg,{})".format(name, values))
+			self.addDotCommand("step","param","seg",0,len(segments) - 1,1)
+		return self.iterNetlist(self.iterDefaultComponents(grid, probe_strings, probe_bypassdiode, hierarchical))
+
+	def iterDefaultComponents(self,grid,probe_strings,probe_bypassdiode,hierarchical,scenarios=None):	#generator of the grid and bias source lines
+		if scenarios is not None:
+			if hierarchical:
+				raise ValueError("Scenarios can not be used with the hierarchical netlist")
+			if len(scenarios) == 0:
+				raise ValueError("The list of scenarios is empty")
+			components = grid.iterSteppedComponents(probe_bypassdiode,probe_strings,scenarios)
+		elif hierarchical:
+			components = grid.iterHierarchicalComponents(probe_bypassdiode,probe_strings)
+		else:
+			components = grid.iterAllComponents(probe_bypassdiode,probe_strings)
+		for line in components:
+			yield line
+		yield "vbias {node1} {node0} {value}".format( node1 = grid.node1, node0 = grid.node0, value = "0" )
+
+	def setDefaultCommands(self,upperv,precision,scenarios=None,lowerv=0):	#dot commands of the default simulation
 		self.clearDotCommand()
 
-		self.addComponent(grid.writeAllComponents(probe_bypassdiode,probe_strings))
-		self.addComponent("vbias {node1} {node0} {value}".format( node1 = grid.node1, node0 = grid.node0, value = "0" ) )
-		
 		""" The temperature of the circuit is always kept on 25°C since the temp effects has already been considered during
 		the parameters generation of each cell, and the temperature of each bypass diode are configured one by one during
 		its declaration. """	
 		self.addDotCommand("temp","25")			
 
-		""" Dbypass is the name given to the model of the bypass diode. The information that follows are the configurations
-		of an schottky diode, usually used as bypass diodes for PV modules. Parameters may be adapted to different models
-		if the values are known """
-		self.addDotCommand("model","Dbypass","D(IS=3.47597e-05 RS=0.00960369 N=1.28962 EG=0.428428 XTI=5 BV=45 IBV=0.0002 CJO=1e-11 VJ=0.7 M=0.5 FC=0.5 TT=0 KF=0 AF=1)")
+		""" Dbypass is the name given to the model of the bypass diode (see DBYPASS_MODEL) """
+		self.addDotCommand("model","Dbypass","D({})".format(
+			" ".join( "{}={}".format(key, value) for key, value in DBYPASS_MODEL.items() ) ))
 		
 		""" I(Vbias) is the current that flows through the bias voltage souce"""
 		self.addDotCommand("probe", "I(Vbias)")
-		self.addDotCommand("dc","vbias",0,str(upperv),str(precision))
-
-		txt = self.buildNetlist()
-		return txt
+		self.addDotCommand("dc","vbias",lowerv,str(upperv),str(precision))
+		if scenarios is not None:
+			self.addDotCommand("step","param","run",0,len(scenarios) - 1,1)
 
 """ This is a class associated to the extract_raw_file. It is a container for the data extracted from the
 	simulation output. The values are store in the "self.values" attribute"""
@@ -446,63 +1242,118 @@ class node_value_class:
 	node value class. It divides the data in four different kinds: the bias voltage, the current
 	of the bias voltage source, string current and the bypass diode current.
 		This class has four important attributes as output:
-		self.probe_vbias, self.probe_ibias, self.probe_strings, self.probe_bypass  """
+		self.probe_vbias, self.probe_ibias, self.probe_strings, self.probe_bypass
+		Both the ASCII and the binary LTspice formats are accepted. The ASCII values are parsed at once
+	into the array self.data (one line per point, one column per variable). The binary values are
+	memory mapped (self.data is a numpy.memmap with one record per point), so a trace is only read from
+	the disk when it is used. In both cases the "values" of each node is a view of its column. The
+	header fields are kept on the dictionary self.header.  """
 class extract_raw_file:	
 	def __init__(self,raw_filepath):
 		self.nodes = []
 		self.raw_filepath = raw_filepath
 
-		#Open file for reading
-		f = open(self.raw_filepath,"r")
-		self.raw_file_lines = f.readlines()
+		#Open file for reading (only up to the end of the header)
+		f = open(self.raw_filepath,"rb")
 		self.name = os.path.basename(f.name)  #Get file name without path
+		head = b""
+		while True:
+			chunk = f.read(65536)
+			head = head + chunk
+			self.find_header_end(head)
+			if self.data_offset is not None or chunk == b"":
+				break
 		f.close()
 
 		#Check if file is ok
-		try:
-			("LTspice" in self.raw_file_lines[7])
-		except:
+		if self.data_offset is None or "Variables:" not in self.raw_header:
 			raise TypeError('The choosen file is not LTspice output')
 
 		# Execute the two routines associated with the data reading. For futher understandment, see a .raw output
 		#file from any simulation done by the software.
-		self.get_data()
+		if self.binary:
+			self.get_binary_data()
+		else:
+			self.get_data()
 		self.sort_node_type()
-
+		self.get_steps()
+
+	#	Looks for the line that ends the header ("Values:" on ASCII files, "Binary:" on binary files). LTspice writes
+	#the text either in UTF-16 or in an 8-bit encoding. Sets the encoding, the header text, the data format and the
+	#position where the data starts (None if the header is not complete)
+	def find_header_end(self,head):
+		self.data_offset = None
+		self.encoding = "utf-16-le" if head[1:2] == b"\x00" else "latin-1"
+		for marker, binary in (("Binary:", True), ("Values:", False)):
+			position = head.find(marker.encode(self.encoding))
+			if position < 0:
+				continue
+			newline = head.find("\n".encode(self.encoding), position)
+			if newline < 0:
+				continue
+			self.data_offset = newline + len("\n".encode(self.encoding))
+			self.binary = binary
+			self.raw_header = head[:position].decode(self.encoding)
+			return
+
+	def get_header(self):		#reads the "key: value" fields of the header and the variables list
+		self.header = {}
+		lines = self.raw_header.splitlines()
+		for i, line in enumerate(lines):
+			if line.startswith("Variables:"):
+				break
+			key, sep, value = line.partition(":")
+			if sep:
+				self.header[key.strip()] = value.strip()
+		if "No. Variables" not in self.header or "No. Points" not in self.header:
+			raise TypeError('The choosen file is not LTspice output')
+		self.num_var = int(self.header["No. Variables"])
+		self.num_points = int(self.header["No. Points"])
+		for line in lines[i+1 : i+1+self.num_var]:
+			number, name, node_type = line.split()[:3]
+			self.nodes.append( node_value_class( name.lower(), node_type.lower(), int(number) ) )
+		if len(self.nodes) != self.num_var:
+			raise ValueError('{} lists {} of its {} variables'.format(self.name, len(self.nodes), self.num_var))
+
+	def check_points(self,npoints):		#a truncated file (e.g. a simulation that was killed) would give incomplete probes
+		if npoints != self.num_points:
+			raise ValueError('{} has {} of its {} points'.format(self.name, npoints, self.num_points))
+
+	def get_binary_data(self):
+		#Getting number of variables, number of points and variable names and types
+		self.get_header()
+
+		#	Each point is a record with the sweep variable as double and the others as float (or all of them as double
+		#if the flag "double" is set)
+		flags = self.header.get("Flags", "").lower().split()
+		if "complex" in flags:
+			raise TypeError('Complex LTspice output (AC analysis) is not supported')
+		value_type = "<f8" if "double" in flags else "<f4"
+		record = np.dtype( [("v0", "<f8")] + [ ("v{}".format(i), value_type) for i in range(1, self.num_var) ] )
+		npoints = min( (os.path.getsize(self.raw_filepath) - self.data_offset)//record.itemsize, self.num_points )
+		self.check_points(npoints)
+		self.data = np.memmap(self.raw_filepath, dtype=record, mode="r", offset=self.data_offset, shape=(npoints,))
+		for i, node in enumerate(self.nodes):
+			node.values = self.data["v{}".format(i)]
 
 	def get_data(self):
-		#Getting number of variables
-		words = self.raw_file_lines[4].split()
-		self.num_var = words[2]
-		#Getting number of points
-		words = self.raw_file_lines[5].split()
-		self.num_points = words[2]
-		#Getting variable names, types and values
-		Variables = False
-		Values = False
-		for line in self.raw_file_lines[8:]:
-			if "Values" in line:
-				Values = True
-				Variables = False
-				continue	#exits the loop to read next line
-
-			if "Variables" in line:
-				Values = False
-				Variables = True
-				continue	#exits the loop to read next line
-
-			if Variables == True:
-				number, name, node_type = line.split()
-				self.nodes.append( node_value_class( name.lower(), node_type.lower(), int(number) ) )			
-
-			if Values == True:
-				words = line.split()
-				if len(words) == 2:
-					self.nodes[0].values.append( float(words[1]) )
-					count = 1
-				else:
-					self.nodes[count].values.append( float(words[0]) )
-					count = count + 1
+		#Getting number of variables, number of points and variable names and types
+		self.get_header()
+
+		#	Getting the values: each point is written as its index followed by the value of each variable, so the
+		#whole block is parsed by NumPy as a single array of num_var + 1 columns. 8-bit files are parsed straight from the file, without holding their text
+		with open(self.raw_filepath, "rb") as f:
+			f.seek(self.data_offset)
+			if self.encoding == "latin-1":
+				values = np.fromfile(f, sep=" ")
+			else:
+				values = np.fromstring(f.read().decode(self.encoding, "ignore"), sep=" ")
+		npoints = min( len(values)//(self.num_var + 1), self.num_points )
+		self.check_points(npoints)
+		data = values[: npoints*(self.num_var + 1)].reshape(npoints, self.num_var + 1)
+		self.data = data[:, 1:]
+		for i, node in enumerate(self.nodes):
+			node.values = self.data[:, i]
 
 	# 	Identification and sorting of the different types of data 
 	#(four types: bias voltage, grid current, string's currents and bypasses' current)
@@ -542,60 +1393,1556 @@ class extract_raw_file:
 				self.probe_bypass[-1].name = 'Bypass N°{} from S.{},P.{}'.format(bypass_n,str_n,panel_n)
 		del self.nodes
 
+	#	Stepped simulations (.step) write all the steps one after the other: each step starts where the bias voltage
+	#sweep goes back. self.steps has the (first, last + 1) points of each step
+	def get_steps(self):
+		vbias = np.asarray(self.probe_vbias.values)
+		starts = [0] + (np.flatnonzero(np.diff(vbias) < 0) + 1).tolist()
+		self.steps = list(zip(starts, starts[1:] + [len(vbias)]))
+		self.num_steps = len(self.steps)
+
+	#	Returns a copy of this object with the values of the step k only (views of the same data), with the same
+	#probe_vbias, probe_ibias, probe_strings and probe_bypass interface
+	def get_step(self,k):
+		first, last = self.steps[k]
+		def node_step(node):
+			new_node = copy.copy(node)
+			new_node.values = node.values[first:last]
+			return new_node
+		step = copy.copy(self)
+		step.name = "{} (step {})".format(self.name, k)
+		step.probe_vbias = node_step(self.probe_vbias)
+		step.probe_ibias = node_step(self.probe_ibias)
+		step.probe_strings = [ node_step(node) for node in self.probe_strings ]
+		step.probe_bypass = [ node_step(node) for node in self.probe_bypass ]
+		step.steps = [ (0, last - first) ]
+		step.num_steps = 1
+		return step
+
+""" class simulationjob is a single simulation of the class jobrunner: the .cir file, the .raw file written by the simulator
+	and, after the run, the parsed result (extract_raw_file) or the error that made all the attempts fail """
+class simulationjob:
+	def __init__(self,cir_filepath,raw_filepath=None):
+		self.cir_filepath = cir_filepath
+		if raw_filepath is None:
+			raw_filepath = os.path.splitext(cir_filepath)[0] + ".raw"
+		self.raw_filepath = raw_filepath
+		self.result = None
+		self.error = None
+		self.attempts = 0
+
+""" class jobrunner runs many netlists on the simulator at the same time. Each simulator call is a separate process,
+	so the pool only has threads waiting for them (at most max_workers simulations run together). A simulation that
+	takes longer than "timeout" seconds is killed, and a failed simulation is tried again up to "retries" times """
+class jobrunner:
+	def __init__(self,command=None,max_workers=None,timeout=None,retries=0):
+		if command is None:
+			command = SIMULATOR_COMMAND
+		elif isinstance(command, str):
+			command = shlex.split(command)
+		self.command = list(command)
+		self.max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+		self.timeout = timeout
+		self.retries = retries
+
+	def backendKey(self):	#description of the simulator used by the result_cache keys
+		return "spice " + " ".join(self.command)
+
+	def runJob(self,job):	#runs one job (with its retries) on the calling thread
+		for attempt in range(self.retries + 1):
+			job.attempts = attempt + 1
+			try:
+				if os.path.exists(job.raw_filepath):	#an old .raw file would be taken as the result of a failed run
+					os.remove(job.raw_filepath)
+				subprocess.run(self.command + [job.cir_filepath], timeout=self.timeout, check=True,
+							   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+				job.result = extract_raw_file(job.raw_filepath)
+				job.error = None
+				return job
+			except (subprocess.SubprocessError, OSError, TypeError, ValueError, IndexError) as error:	#failed run or unreadable .raw file
+				job.error = error
+		return job
+
+	#	Generator that runs all the jobs (simulationjob objects or .cir file paths) and yields each job as it completes,
+	#in completion order. The jobs that failed are yielded with job.result = None and the last error in job.error
+	def iterRun(self,jobs):
+		jobs = [ job if isinstance(job, simulationjob) else simulationjob(job) for job in jobs ]
+		with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+			futures = [ pool.submit(self.runJob, job) for job in jobs ]
+			for future in as_completed(futures):
+				yield future.result()
+
+	def run(self,jobs):		#runs all the jobs and returns them in the given order
+		jobs = [ job if isinstance(job, simulationjob) else simulationjob(job) for job in jobs ]
+		for job in self.iterRun(jobs):
+			pass
+		return jobs
+
+	#	Adaptive sweep (see adaptivesweep) simulated by the SPICE simulator: all the refined regions of each pass are
+	#a single netlist ("{cir_base}_sweep.cir", see netlist.iterSegmentsNetlist), so each pass is one run of the
+	#simulator. The netlist and its .raw file are replaced on each pass. Returns a native_output with the merged points
+	def adaptiveRun(self,grid,upperv,precision,cir_base,tol=None,probe_strings=True,probe_bypassdiode=True,hierarchical=False,name=None):
+		if name is None:
+			name = os.path.basename(cir_base)
+		first = []			#first result, which gives the probes of the output
+		def evaluate(segments,points):
+			job = simulationjob(cir_base + "_sweep.cir")
+			nl = netlist(name)
+			with open(job.cir_filepath, "w") as f:
+				nl.writeFile(f, nl.iterSegmentsNetlist(grid, segments, probe_strings, probe_bypassdiode, hierarchical))
+			self.runJob(job)
+			if job.error is not None:
+				raise RuntimeError("The simulation of {} failed ({})".format(job.cir_filepath, job.error))
+			result = job.result
+			if first == []:
+				first.append(result)
+			v = np.array(result.probe_vbias.values, dtype=float)		#the steps of all the segments, one after the other
+			I = np.array(result.probe_ibias.values, dtype=float)
+			columns = np.array([ node.values for node in result.probe_strings + result.probe_bypass ], dtype=float).reshape(-1, len(v))
+			result.data = None		#releases the memory mapped file, which is replaced on the next pass (only the probe names are kept)
+			for node in [ result.probe_vbias, result.probe_ibias ] + result.probe_strings + result.probe_bypass:
+				node.values = None
+			job.result = None
+			return v, I, columns
+
+		sweep = adaptivesweep(upperv, precision, tol)
+		v, I, columns = sweep.run(evaluate)
+		def new_node(node,values):
+			node = copy.copy(node)
+			node.values = values
+			return node
+		result = first[0]
+		nstrings = len(result.probe_strings)
+		output = native_output(name)
+		output.steps = [ (0, len(v)) ]
+		output.probe_vbias = new_node(result.probe_vbias, v)
+		output.probe_ibias = new_node(result.probe_ibias, I)
+		output.probe_strings = [ new_node(node, columns[idx]) for idx, node in enumerate(result.probe_strings) ]
+		output.probe_bypass = [ new_node(node, columns[nstrings + idx]) for idx, node in enumerate(result.probe_bypass) ]
+		return output
+
+""" class adaptivesweep chooses the bias voltages of a sweep from 0 to upperv. It starts with "initial" equal steps and,
+	pass after pass, halves the steps of the regions where the curve is not well described: where the grid current
+	is more than "tol" away from the line between the neighbouring points (knees of the bypass diodes) and around
+	every local maximum of the power. The steps are not reduced below "precision", which is the resolution of the
+	maximum power points, so the curve has much fewer points than a sweep with a fixed step equal to "precision".
+	Points closer than precision/2 are the same point. The default "tol" is 0.1% of the largest current of the first
+	pass. """
+class adaptivesweep:
+	def __init__(self,upperv,precision,tol=None,initial=32,maxpoints=5000):
+		self.upperv = float(upperv)
+		self.precision = float(precision)
+		self.tol = tol
+		self.initial = initial
+		self.maxpoints = maxpoints
+		self.passes = 0
+		self.evaluations = 0		#number of regions (segments) evaluated
+
+	def segmentPoints(self,segments):	#bias voltages of the (start, stop, step) segments
+		return np.concatenate([ start + step*np.arange(int(np.floor((stop - start)/step + 1e-9)) + 1) for start, stop, step in segments ])
+
+	def refineSegments(self,v,I):		#(start, stop, step) segments of the regions to be refined
+		width = np.diff(v)
+		refine = np.zeros(len(width), dtype=bool)
+		if len(v) > 2:
+			chord = I[:-2] + (I[2:] - I[:-2])*(v[1:-1] - v[:-2])/(v[2:] - v[:-2])
+			P = v*I
+			peak = (P[1:-1] >= P[:-2]) & (P[1:-1] >= P[2:])
+			flag = (np.abs(I[1:-1] - chord) > self.tol) | peak
+			refine[:-1] |= flag
+			refine[1:] |= flag
+		refine &= width >= 2*self.precision		#the halved steps are never smaller than precision
+		#	Each segment is a run of consecutive steps of the same width, so its points are the midpoints of the steps
+		#and the points already solved
+		idx = np.flatnonzero(refine)
+		breaks = (np.diff(idx) > 1) | ~np.isclose(width[idx[1:]], width[idx[:-1]], rtol=1e-6, atol=0)
+		segments = []
+		for run in np.split(idx, np.flatnonzero(breaks) + 1):
+			if len(run) > 0:
+				segments.append( (v[run[0]], v[run[-1] + 1], width[run[0]]/2) )
+		return segments
+
+	def isNew(self,points,v):		#flags of the points farther than precision/2 from all the (sorted) points v
+		if len(v) == 0:
+			return np.ones(len(points), dtype=bool)
+		k = np.searchsorted(v, points)
+		distance = np.minimum(np.abs(points - v[np.maximum(k - 1, 0)]), np.abs(points - v[np.minimum(k, len(v) - 1)]))
+		return distance > self.precision/2
+
+	#	evaluate(segments, points) must return the bias voltages, the grid currents and the other probes (one line per
+	#probe) of the new points, which are the "points" (voltages of the segments not evaluated yet) or all the points
+	#of the segments. Returns the merged and sorted bias voltages, grid currents and probes
+	def run(self,evaluate):
+		segments = [ (0.0, self.upperv, max(self.upperv/self.initial, self.precision)) ]
+		v = np.zeros(0)
+		I = np.zeros(0)
+		columns = None
+		while segments != [] and len(v) < self.maxpoints:
+			points = self.segmentPoints(segments)
+			points = points[ self.isNew(points, v) ]
+			if len(points) == 0:
+				break
+			nv, nI, ncolumns = evaluate(segments, points)
+			self.passes += 1
+			self.evaluations += len(segments)
+			v = np.concatenate((v, nv))
+			I = np.concatenate((I, nI))
+			columns = ncolumns if columns is None else np.concatenate((columns, ncolumns), axis=1)
+			order = np.argsort(v, kind="stable")		#sorted, without repeated points (the first one is kept)
+			order = order[ np.concatenate(([True], np.diff(v[order]) > self.precision/2)) ]
+			v = v[order]
+			I = I[order]
+			columns = columns[:,order]
+			if self.tol is None:
+				self.tol = 0.001*np.max(np.abs(I))
+			segments = self.refineSegments(v, I)
+		return v, I, columns
+
+""" class solverplan is the compiled, array based description of a pvgrid used by the native solver. Every string
+	is split into "units": each bypass diode together with the cells it covers is one unit, and all the cells
+	of the string not covered by any bypass diode form one last unit without diode (series cells carry the same
+	current, so their order does not matter). The cells of all units are stored as "entries", each one with the
+	circuit parameters of the cell_py subcircuit (see cell_component_py.lib) and a count of identical cells.
+	Units are stored string after string and entries unit after unit, so sums are done with np.add.reduceat.
+		The plan is compressed (see compress): the cells of a unit with the same conditions are a single entry and the
+	identical units of a string are a single unit, so the solution cost depends on the number of distinct conditions
+	instead of the size of the grid. Identical parallel strings are also solved only once (see compressStrings). """
+class solverplan:
+	#	"strings" selects the strings of the grid (all of them by default). Without "compress" every cell keeps its own
+	#entry, so their parameters may be changed one by one (see montecarlo)
+	def __init__(self,grid,tnom,strings=None,compress=True):
+		parameters = grid.parameters
+		if strings is None:
+			strings = range(len(grid.modules))
+		self.strings = np.array(strings, dtype=int)
+		self.nstrings = len(self.strings)
+
+		#Lists that will be converted to arrays
+		unit_string = []		#string of each unit
+		unit_mult = []			#number of identical units in series inside the string
+		unit_is = []			#bypass diode saturation current at its temperature (0 for units without diode)
+		unit_nvt = []			#bypass diode emission coefficient times its thermal voltage
+		entry_unit = []			#unit of each entry
+		entry_count = []		#number of identical cells in series represented by the entry
+		entry_temp = []			#cell temperature (°C)
+		entry_irrad = []		#cell irradiance (W/m^2)
+		self.bypass_probes = []	#(string, module, diode number, unit) of each bypass diode
+
+		for pos, s in enumerate(self.strings.tolist()):
+			string = grid.modules[s]
+			free_temp = []
+			free_irrad = []
+			for module in string:
+				cell_temp = grid.state.cell_temp[module.index]
+				cell_irrad = grid.state.cell_irrad[module.index]
+				covered = np.zeros(len(cell_temp), dtype=bool)
+				for num, (node_a, node_b) in enumerate(module.bypassSegments()):
+					unit = len(unit_string)
+					unit_string.append(pos)
+					unit_mult.append(1)
+					Is, nvt = self.diodeParameters(module.diode_temp[num], parameters.kelvin, parameters.k, parameters.q, tnom)
+					unit_is.append(Is)
+					unit_nvt.append(nvt)
+					ncells = node_b + 1 - node_a
+					entry_unit.extend( [unit]*ncells )
+					entry_count.extend( [1]*ncells )
+					entry_temp.extend( cell_temp[node_a:node_b+1].tolist() )
+					entry_irrad.extend( cell_irrad[node_a:node_b+1].tolist() )
+					covered[node_a:node_b+1] = True
+					self.bypass_probes.append( (s, module.column, num, unit) )
+				free_temp.extend( cell_temp[~covered].tolist() )
+				free_irrad.extend( cell_irrad[~covered].tolist() )
+			if free_temp != []:
+				unit = len(unit_string)
+				unit_string.append(pos)
+				unit_mult.append(1)
+				unit_is.append(0.0)
+				unit_nvt.append(1.0)
+				entry_unit.extend( [unit]*len(free_temp) )
+				entry_count.extend( [1]*len(free_temp) )
+				entry_temp.extend( free_temp )
+				entry_irrad.extend( free_irrad )
+
+		self.unit_string = np.array(unit_string, dtype=int)
+		self.unit_mult = np.array(unit_mult, dtype=float)
+		self.unit_is = np.array(unit_is, dtype=float)
+		self.unit_nvt = np.array(unit_nvt, dtype=float)
+		entry_temp = np.array(entry_temp, dtype=float)
+		entry_irrad = np.array(entry_irrad, dtype=float)
+		if compress:
+			entry_temp, entry_irrad = self.compress( np.array(entry_unit, dtype=int), np.array(entry_count, dtype=float),
+													  entry_temp, entry_irrad )
+			entry_temp, entry_irrad = self.compressStrings(entry_temp, entry_irrad)
+		else:
+			self.entry_unit = np.array(entry_unit, dtype=int)
+			self.entry_count = np.array(entry_count, dtype=float)
+			self.string_class = np.arange(self.nstrings)
+			self.string_rep = self.strings
+		self.unit_diode = self.unit_is > 0
+		self.setCellParameters(parameters, entry_temp, entry_irrad)
+		self.setPointers()
+
+	#	Merges the identical cells of each unit into one entry (series cells with the same conditions have the same
+	#voltage) and then the identical units of each string into one unit (same bypass diode temperature and same
+	#entries), counted by unit_mult. The bypass probes of the merged units point to their representative, since
+	#identical units in series carry the same currents. Returns the temperature and irradiance of the entries
+	def compress(self,entry_unit,entry_count,entry_temp,entry_irrad):
+		rows, inverse = np.unique(np.column_stack((entry_unit, entry_temp, entry_irrad)), axis=0, return_inverse=True)
+		entry_count = np.bincount(inverse.reshape(-1), weights=entry_count, minlength=len(rows))
+		entry_unit = rows[:,0].astype(int)
+		entries = rows[:,1:]
+
+		nunits = len(self.unit_string)
+		ptr = np.searchsorted(entry_unit, np.arange(nunits + 1))
+		classes = {}
+		unit_class = np.zeros(nunits, dtype=int)
+		for u in range(nunits):
+			signature = ( self.unit_string[u], self.unit_is[u], self.unit_nvt[u],
+						  entries[ptr[u]:ptr[u+1]].tobytes(), entry_count[ptr[u]:ptr[u+1]].tobytes() )
+			unit_class[u] = classes.setdefault(signature, len(classes))
+		representative = np.unique(unit_class, return_index=True)[1]	#first unit of each class (units stay ordered by string)
+
+		self.unit_mult = np.bincount(unit_class, weights=self.unit_mult, minlength=len(representative))
+		self.unit_string = self.unit_string[representative]
+		self.unit_is = self.unit_is[representative]
+		self.unit_nvt = self.unit_nvt[representative]
+		kept = np.isin(entry_unit, representative)
+		self.entry_unit = unit_class[entry_unit[kept]]
+		self.entry_count = entry_count[kept]
+		self.bypass_probes = [ (s, module, num, int(unit_class[unit])) for s, module, num, unit in self.bypass_probes ]
+		return entries[kept,0], entries[kept,1]
+
+	#	Keeps only one string of each group of identical strings (same units, in any order, since the series order does
+	#not matter): all the strings share the bias voltage, so they have the same currents. self.string_class has the
+	#solved string of each string of the grid and self.nstrings becomes the number of solved strings. The units of the
+	#removed strings are mapped to the same unit of their representative, which is used by their bypass probes
+	def compressStrings(self,entry_temp,entry_irrad):
+		nunits = len(self.unit_string)
+		ptr = np.searchsorted(self.entry_unit, np.arange(nunits + 1))
+		unit_signature = [ ( self.unit_mult[u], self.unit_is[u], self.unit_nvt[u], entry_temp[ptr[u]:ptr[u+1]].tobytes(),
+							 entry_irrad[ptr[u]:ptr[u+1]].tobytes(), self.entry_count[ptr[u]:ptr[u+1]].tobytes() ) for u in range(nunits) ]
+		string_ptr = np.searchsorted(self.unit_string, np.arange(self.nstrings + 1))
+		classes = {}
+		self.string_class = np.zeros(self.nstrings, dtype=int)
+		for s in range(self.nstrings):		#the units of a string are all different after compress, so a set describes it
+			signature = frozenset(unit_signature[string_ptr[s]:string_ptr[s+1]])
+			self.string_class[s] = classes.setdefault(signature, len(classes))
+		representative = np.unique(self.string_class, return_index=True)[1]
+		self.string_rep = self.strings[representative]		#grid string solved for each class
+
+		kept_units = np.isin(self.unit_string, representative)
+		new_unit = np.cumsum(kept_units) - 1
+		unit_class = self.string_class[self.unit_string]
+		lookup = { (unit_class[u], unit_signature[u]): new_unit[u] for u in np.flatnonzero(kept_units) }
+		unit_map = np.array([ lookup[(unit_class[u], unit_signature[u])] for u in range(nunits) ], dtype=int)
+
+		kept_entries = kept_units[self.entry_unit]
+		self.entry_unit = unit_map[self.entry_unit[kept_entries]]
+		self.entry_count = self.entry_count[kept_entries]
+		self.unit_string = unit_class[kept_units]
+		self.unit_mult = self.unit_mult[kept_units]
+		self.unit_is = self.unit_is[kept_units]
+		self.unit_nvt = self.unit_nvt[kept_units]
+		self.bypass_probes = [ (s, module, num, int(unit_map[unit])) for s, module, num, unit in self.bypass_probes ]
+		self.nstrings = len(representative)
+		return entry_temp[kept_entries], entry_irrad[kept_entries]
+
+	#	New plan with n copies of the strings, one after the other (the copies of the strings of the grid are solved
+	#as different strings, see montecarlo)
+	def repeat(self,n):
+		plan = copy.copy(self)
+		nunits = len(self.unit_string)
+		plan.strings = np.tile(self.strings, n)
+		plan.nstrings = n*self.nstrings
+		plan.string_class = np.arange(plan.nstrings)
+		plan.string_rep = plan.strings
+		plan.unit_string = ( self.unit_string[None,:] + self.nstrings*np.arange(n)[:,None] ).ravel()
+		plan.entry_unit = ( self.entry_unit[None,:] + nunits*np.arange(n)[:,None] ).ravel()
+		for name in ("unit_mult", "unit_is", "unit_nvt", "unit_diode", "entry_count", "entry_i0", "entry_iph",
+					 "entry_vt", "entry_rs", "entry_rsh"):
+			setattr(plan, name, np.tile(getattr(self, name), n))
+		plan.bypass_probes = [ (s, module, num, unit + r*nunits) for r in range(n) for s, module, num, unit in self.bypass_probes ]
+		plan.setPointers()
+		return plan
+
+	#	New plan with only the solved strings "classes" (sorted) of this one. self.units of the new plan has the number of
+	#each of its units on this plan (see pvsolver.solveParallel)
+	def subset(self,classes):
+		plan = copy.copy(self)
+		units = np.flatnonzero(np.isin(self.unit_string, classes))
+		entries = np.flatnonzero(np.isin(self.entry_unit, units))
+		new_string = np.full(self.nstrings, -1)
+		new_string[classes] = np.arange(len(classes))
+		new_unit = np.full(len(self.unit_string), -1)
+		new_unit[units] = np.arange(len(units))
+		plan.nstrings = len(classes)
+		plan.string_class = np.arange(len(classes))
+		plan.string_rep = self.string_rep[classes]
+		plan.unit_string = new_string[self.unit_string[units]]
+		plan.entry_unit = new_unit[self.entry_unit[entries]]
+		for name in ("unit_mult", "unit_is", "unit_nvt", "unit_diode"):
+			setattr(plan, name, getattr(self, name)[units])
+		for name in ("entry_count", "entry_i0", "entry_iph", "entry_vt", "entry_rs", "entry_rsh"):
+			setattr(plan, name, getattr(self, name)[entries])
+		plan.units = units
+		plan.bypass_probes = [ (s, module, num, int(new_unit[unit])) for s, module, num, unit in self.bypass_probes if new_unit[unit] >= 0 ]
+		plan.setPointers()
+		return plan
+
+	def setPointers(self):		#first unit of each string and first entry of each unit (used by np.add.reduceat)
+		self.string_ptr = np.searchsorted(self.unit_string, np.arange(self.nstrings))
+		self.unit_ptr = np.searchsorted(self.entry_unit, np.arange(len(self.unit_string)))
+		self.ibp = None			#last currents of the bypass diodes (starting point of the next solution)
+
+	def setCellParameters(self,parameters,temp,irrad):	#same values written by pvcell.writeCommandLine on the cell_py lines
+		I0, Iph, Rs, Rsh, A = parameters.get_parameters(temp)
+		self.entry_i0 = I0
+		self.entry_iph = Iph * irrad / 1000.0
+		self.entry_vt = A * parameters.k * parameters.stdtemp / parameters.q
+		self.entry_rs = Rs / parameters.Ns
+		self.entry_rsh = Rsh / parameters.Ns
+
+	def diodeParameters(self,temp,kelvin,k,q,tnom):	#Dbypass saturation current and n*Vt at the diode temperature (SPICE model)
+		T = temp + kelvin
+		vt = k*T/q
+		n = DBYPASS_MODEL["N"]
+		Is = DBYPASS_MODEL["IS"] * np.exp( (T/tnom - 1)*DBYPASS_MODEL["EG"]/(n*vt) + DBYPASS_MODEL["XTI"]/n*np.log(T/tnom) )
+		return Is, n*vt
+
+
+""" class pvsolver is the native (in-process) replacement of the LTspice simulation. It solves the same circuit
+	written by netlist.defaultRun: every cell follows the equation of gausspv.calcExpression with its own
+	parameters (I = Iph - I0*[exp((V+Rs*I)/Vt) - 1] - (V+Rs*I)/Rsh), the bypass diodes follow the Dbypass model
+	(saturation current, series resistance, emission coefficient and temperature dependence) and the strings
+	have the same small probe resistance in series. The breakdown (BV) and the junction capacitances of the
+	Dbypass model are not modeled, since they play no role on a DC sweep of a usual grid.
+		All the equations are monotonic, so each level is solved by a safeguarded Newton method (Newton steps
+	kept inside a bisection bracket), vectorized over all strings and bias voltages at once:
+		- cell: diode voltage for a given cell current
+		- bypassed unit: split of the string current between the cells and the bypass diode
+		- string: string current for a given bias voltage	"""
+class pvsolver:
+	def __init__(self,xtol=1e-9,maxiter=100,warm_start=True,workers=1):
+		self.xtol = xtol			#absolute tolerance of the iterations (V or A)
+		self.maxiter = maxiter		#maximum number of iterations of each level
+		self.rprobe = 0.000001		#value of the rprobe resistors written by pvgrid.writeAllComponents
+		self.tnom = 27.0 + 273.15	#SPICE default nominal temperature, used by the Dbypass model
+		self.warm_start = warm_start	#the last solution of each string is the starting point of the next one
+		self.warm = {}				#last solution of each string of the grid (see keepSolution)
+		self.workers = workers		#processes sharing the strings of large solutions (see solveParallel)
+		self.parallel_size = 200000	#smallest number of cells x bias voltages solved on many processes
+		self.pool = None			#process pool of solveParallel, created on its first use (see close)
+		self.resetStats()
+
+	def close(self):		#shuts down the process pool of solveParallel
+		if self.pool is not None:
+			self.pool.shutdown()
+			self.pool = None
+
+	def __getstate__(self):		#the process pool stays on this process when the solver is pickled (see montecarlo)
+		state = self.__dict__.copy()
+		state["pool"] = None
+		return state
+
+	#	Convergence statistics: "solves" (string current solutions), "points" (bias voltages solved), "warm_starts"
+	#(solutions started from a previous one) and "iterations" (Newton iterations of the string currents, summed over
+	#the bias voltages)
+	def resetStats(self):
+		self.stats = { "solves": 0, "points": 0, "warm_starts": 0, "iterations": 0 }
+
+	def convergenceReport(self):
+		points = max(self.stats["points"], 1)
+		return "{} solves ({} warm started), {:.2f} Newton iterations per point".format(
+			self.stats["solves"], self.stats["warm_starts"], self.stats["iterations"]/points)
+
+	def backendKey(self):	#description of the solver used by the result_cache keys
+		return "native xtol={} maxiter={}".format(self.xtol, self.maxiter)
+
+	#	Safeguarded Newton method for increasing functions: lo and hi must bracket the roots and x0 (optional)
+	#is the starting point. Newton steps that leave the bracket are replaced by bisection steps. The arrays are
+	#2-D and func(x,cols) is only evaluated on the columns that still have elements to converge. The iterations of
+	#every column are added to self.stats[counter], if given
+	def rootSearch(self,func,lo,hi,x0=None,counter=None):
+		if x0 is None:
+			x = 0.5*(lo + hi)
+		else:
+			x = np.where( (x0 >= lo) & (x0 <= hi), x0, 0.5*(lo + hi) )
+		lo = lo.copy()
+		hi = hi.copy()
+		cols = np.arange(x.shape[1])
+		fa = np.full(x.shape, np.inf)		#last |f| of every element
+		evaluated = 0
+		for i in range(self.maxiter):
+			xc = x[:,cols]
+			evaluated += len(cols)
+			f, df = func(xc,cols)
+			loc = np.where(f < 0, xc, lo[:,cols])
+			hic = np.where(f > 0, xc, hi[:,cols])
+			with np.errstate(divide='ignore', invalid='ignore'):
+				step = f/df
+			xn = xc - step
+			#a converged step is accepted even if it touches the bracket; a Newton step that did not halve |f| bisects
+			#instead, otherwise the iterates can cycle around a knee without ever leaving the bracket
+			bisect = ~np.isfinite(xn) | ( ((xn <= loc) | (xn >= hic) | (np.abs(f) > 0.5*fa[:,cols])) & ~(np.abs(step) <= self.xtol) )
+			fa[:,cols] = np.abs(f)
+			xn = np.where(bisect, 0.5*(loc + hic), xn)
+			done = np.abs(xn - xc) <= self.xtol
+			x[:,cols] = xn
+			lo[:,cols] = loc
+			hi[:,cols] = hic
+			cols = cols[ ~np.all(done, axis=0) ]
+			if len(cols) == 0:
+				break
+		if counter is not None:
+			self.stats[counter] += evaluated
+		return x
+
+	def cellVoltage(self,plan,Ic):		#voltage and dV/dI of every entry for the currents Ic of its unit
+		I = Ic[plan.entry_unit]
+		Iph = plan.entry_iph[:,None]
+		I0 = plan.entry_i0[:,None]
+		Vt = plan.entry_vt[:,None]
+		Rsh = plan.entry_rsh[:,None]
+		rhs = Iph - I
+		# g(Vd) = I0*[exp(Vd/Vt) - 1] + Vd/Rsh is convex and increasing, so Newton iterations started above the
+		#root converge monotonically to it
+		Vd = Vt*np.log1p(np.maximum(rhs, 0)/I0)
+		for i in range(self.maxiter):
+			e = I0*np.exp(Vd/Vt)
+			gd = e/Vt + 1/Rsh
+			step = (e - I0 + Vd/Rsh - rhs)/gd
+			Vd = Vd - step
+			if np.all(np.abs(step) <= self.xtol):
+				break
+		gd = I0*np.exp(Vd/Vt)/Vt + 1/Rsh
+		V = Vd - I*plan.entry_rs[:,None]
+		dV = -1/gd - plan.entry_rs[:,None]
+		return V, dV
+
+	def chainVoltage(self,plan,Ic):		#voltage and dV/dI of the cells of every unit
+		V, dV = self.cellVoltage(plan,Ic)
+		count = plan.entry_count[:,None]
+		return np.add.reduceat(count*V, plan.unit_ptr, axis=0), np.add.reduceat(count*dV, plan.unit_ptr, axis=0)
+
+	#	Voltage, dV/dI and bypass diode current of every unit for the string currents I. When plan.ibp holds the
+	#bypass currents of a previous solution, the columns cols of it are used as starting point and refreshed
+	def unitVoltage(self,plan,I,cols=None):
+		Iu = I[plan.unit_string]
+		Vc, dVc = self.chainVoltage(plan,Iu)
+		diode = plan.unit_diode[:,None] & np.ones(Iu.shape, dtype=bool)
+		if not np.any(diode):
+			return Vc, dVc, np.zeros(Iu.shape)
+		Is = np.where(diode, plan.unit_is[:,None], 1)
+		nvt = plan.unit_nvt[:,None]*np.ones(Iu.shape)
+		Rd = DBYPASS_MODEL["RS"]
+
+		#	The bypass diode voltage is Vbp(Ibp) = n*Vt*ln(1 + Ibp/Is) + Rd*Ibp and the unit is solved when
+		#Vchain(I - Ibp) + Vbp(Ibp) = 0. When the cells alone would be reverse biased (Vc < 0) the diode conducts
+		#and the unknown is x = -Ic, bracketed by [-I, 0]. Otherwise the diode only leaks (-Is < Ibp < 0) and
+		#the unknown is its junction voltage x = u, bracketed by [-Vc - 1, 0]. Both functions are increasing and
+		#the first one is also concave, so its Newton iterations started from the left (Ibp = 0) never overshoot.
+		conducting = diode & (Vc < 0)
+		def current(x,c):		#bypass diode current and Is + Ibp (kept apart to avoid cancellation)
+			Ibp = np.where(conducting[:,c], Iu[:,c] + x, Is[:,c]*np.expm1(x/nvt[:,c]))
+			return Ibp, np.where(conducting[:,c], Is[:,c] + Ibp, Is[:,c]*np.exp(x/nvt[:,c]))
+		def func(x,c):
+			Ibp, Isbp = current(x,c)
+			V, dV = self.chainVoltage(plan, Iu[:,c] - Ibp)
+			F = V + nvt[:,c]*np.log(Isbp/Is[:,c]) + Rd*Ibp
+			dF = np.where(conducting[:,c], -dV + nvt[:,c]/Isbp + Rd, 1 + (Rd - dV)*Isbp/nvt[:,c])
+			return np.where(diode[:,c], F, 0), np.where(diode[:,c], dF, 1)
+
+		lo = np.where(conducting, -Iu, -Vc - 1)
+		hi = np.zeros(Iu.shape)
+		x0 = np.where(conducting, lo, np.nan)
+		if plan.ibp is not None:		#starting point from the last solution
+			with np.errstate(divide='ignore', invalid='ignore'):
+				x0 = np.where(conducting, plan.ibp[:,cols] - Iu, nvt*np.log1p(plan.ibp[:,cols]/Is))
+			x0 = np.where(conducting & ~(x0 >= lo), lo, x0)
+		x = self.rootSearch(func, np.where(diode, lo, -1), np.where(diode, hi, 1), x0)
+
+		all_cols = np.arange(Iu.shape[1])
+		Ibp, Isbp = current(x,all_cols)
+		Ibp = np.where(diode, Ibp, 0)
+		if plan.ibp is not None:
+			plan.ibp[:,cols] = Ibp
+		V, dV = self.chainVoltage(plan, Iu - Ibp)
+		gbp = Isbp/(nvt + Rd*Isbp)		#small signal conductance of the bypass diode
+		Vseg = np.where(diode, -(nvt*np.log(Isbp/Is) + Rd*Ibp), Vc)
+		dVseg = np.where(diode, dV/(1 - dV*gbp), dVc)
+		return Vseg, dVseg, Ibp
+
+	def stringVoltage(self,plan,I,cols=None):		#voltage, dV/dI and bypass currents of every string for the currents I
+		Vu, dVu, Ibp = self.unitVoltage(plan,I,cols)
+		mult = plan.unit_mult[:,None]
+		Vs = np.add.reduceat(mult*Vu, plan.string_ptr, axis=0) + self.rprobe*I
+		dVs = np.add.reduceat(mult*dVu, plan.string_ptr, axis=0) + self.rprobe
+		return Vs, dVs, Ibp
+
+	def stringCurrent(self,plan,vbias,nsamples=32):		#string currents (nstrings x points) for the bias voltages
+		plan.ibp = None
+		self.stats["solves"] += 1
+		self.stats["points"] += len(vbias)
+		warm = self.warmStart(plan,vbias) if self.warm_start else None
+		if warm is not None:
+			self.stats["warm_starts"] += 1
+			lo, hi, x0, ibp = warm
+		else:
+			lo, hi, x0 = self.coldStart(plan,vbias,nsamples)
+			ibp = np.full((len(plan.unit_string),len(vbias)), np.nan)
+
+		def func(I,cols):
+			Vs, dVs, Ibp = self.stringVoltage(plan,I,cols)
+			return vbias[None,cols] - Vs, -dVs
+		plan.ibp = ibp
+		return self.rootSearch(func, lo, hi, x0, "iterations")
+
+	#	Bracket and starting point of the string currents without a previous solution. f(I) = vbias - Vstring(I) is
+	#increasing: first a bracket containing every bias voltage is found for each string, starting around the largest
+	#photocurrent and expanding it when needed
+	def coldStart(self,plan,vbias,nsamples):
+		Imax = np.max(plan.entry_iph) if len(plan.entry_iph) > 0 else 0.0
+		step = 0.1*Imax + 0.001
+		lo = np.full((plan.nstrings,1), -step)
+		f = np.max(vbias) - self.stringVoltage(plan,lo)[0]
+		while np.any(f > 0):
+			step = 2*step
+			lo = np.where(f > 0, lo - step, lo)
+			f = np.max(vbias) - self.stringVoltage(plan,lo)[0]
+		step = 0.1*Imax + 0.001
+		hi = np.full((plan.nstrings,1), Imax + step)
+		f = np.min(vbias) - self.stringVoltage(plan,hi)[0]
+		while np.any(f < 0):
+			step = 2*step
+			hi = np.where(f < 0, hi + step, hi)
+			f = np.min(vbias) - self.stringVoltage(plan,hi)[0]
+
+		#	The string curves are sampled inside the bracket: the samples around each bias voltage are its
+		#bracket and the linear interpolation between them is the starting point of the Newton iterations
+		Is = lo + (hi - lo)*np.linspace(0, 1, nsamples)[None,:]
+		Vs = self.stringVoltage(plan,Is)[0]
+		x0 = np.zeros((plan.nstrings,len(vbias)))
+		lo = np.zeros(x0.shape)
+		hi = np.zeros(x0.shape)
+		for s in range(plan.nstrings):
+			k = np.clip( np.searchsorted(-Vs[s], -vbias, side='right') - 1, 0, nsamples - 2 )
+			lo[s] = Is[s,k]
+			hi[s] = Is[s,k+1]
+			x0[s] = np.interp(-vbias, -Vs[s], Is[s])
+		return lo, hi, x0
+
+	def stringPhotocurrent(self,plan):		#largest photocurrent of each string of a plan
+		Iph = np.zeros(plan.nstrings)
+		np.maximum.at(Iph, plan.unit_string[plan.entry_unit], plan.entry_iph)
+		return Iph
+
+	#	Bracket, starting point and bypass diode currents taken from the last solution of the strings (interpolated
+	#on the new bias voltages and scaled by the change of their photocurrent, which follows the irradiance between
+	#timesteps). The bracket around the starting point is checked on both ends and expanded where it does not hold
+	#the solution. Returns None when a string has no previous solution
+	def warmStart(self,plan,vbias):
+		if any( s not in self.warm for s in plan.string_rep.tolist() ):
+			return None
+		Iph = self.stringPhotocurrent(plan)
+		x0 = np.array([ np.interp(vbias, *self.warm[s][:2]) for s in plan.string_rep.tolist() ])
+		Iph_warm = np.array([ self.warm[s][3] for s in plan.string_rep.tolist() ])
+		with np.errstate(divide='ignore', invalid='ignore'):
+			scale = np.where(Iph_warm > 0, Iph/Iph_warm, 1.0)
+		x0 = scale[:,None]*x0
+		ibp = np.full((len(plan.unit_string),len(vbias)), np.nan)
+		for s, module, num, unit in plan.bypass_probes:
+			if plan.string_rep[plan.unit_string[unit]] == s and (module, num) in self.warm[s][2]:
+				ibp[unit] = np.interp(vbias, self.warm[s][0], self.warm[s][2][(module, num)])
+		step = 0.01*np.max(np.abs(x0)) + 0.001
+		lo = x0 - step
+		hi = x0 + step
+		npoints = len(vbias)
+		while True:
+			Vs = self.stringVoltage(plan, np.concatenate((lo, hi), axis=1))[0]
+			low = vbias[None,:] - Vs[:,:npoints] > 0		#f(lo) must be negative
+			high = vbias[None,:] - Vs[:,npoints:] < 0		#f(hi) must be positive
+			if not np.any(low) and not np.any(high):
+				return lo, hi, x0, ibp
+			step = 2*step
+			lo = np.where(low, lo - step, lo)
+			hi = np.where(high, hi + step, hi)
+
+	#	Keeps the solution of the strings of a plan (string currents and bypass diode currents of the solved strings,
+	#sorted by bias voltage) as the starting point of the next solutions. While the parameters of a string do not
+	#change its solutions are merged, so the few points of each step of a MPP search build up its whole curve
+	def keepSolution(self,plan,vbias,I,Ibp,maxpoints=4096):
+		Iph = self.stringPhotocurrent(plan)
+		#the entries are sorted by string (units are stored string after string) and the probes are grouped in one pass
+		entry_ptr = np.searchsorted(plan.unit_string[plan.entry_unit], np.arange(plan.nstrings + 1))
+		probes = {}
+		for s, module, num, unit in plan.bypass_probes:
+			probes.setdefault(s, []).append( (module, num, unit) )
+		for c, s in enumerate(plan.string_rep.tolist()):
+			entries = slice(entry_ptr[c], entry_ptr[c+1])
+			signature = b"".join( a[entries].tobytes() for a in (plan.entry_iph, plan.entry_i0, plan.entry_vt,
+				plan.entry_rsh, plan.entry_rs) )
+			v = vbias
+			Is = I[c]
+			bypass = { (module, num): Ibp[unit] for module, num, unit in probes.get(s, []) }
+			if s in self.warm and self.warm[s][4] == signature and len(self.warm[s][0]) < maxpoints:
+				old = self.warm[s]
+				v = np.concatenate((old[0], v))
+				Is = np.concatenate((old[1], Is))
+				bypass = { key: np.concatenate((old[2][key], bypass[key])) for key in bypass if key in old[2] }
+			v, index = np.unique(v, return_index=True)		#sorted, the older point is kept on repeated voltages
+			self.warm[s] = ( v, Is[index], { key: Ib[index] for key, Ib in bypass.items() }, Iph[c], signature )
+
+	#	String currents (nstrings x points) and bypass diode currents (diodes x points) of the grid for the
+	#given bias voltages, together with the (string, module, diode number, unit) reference of each diode
+	#	The solution is kept on grid.solution: the strings are independent for a given bias voltage, so on the next call
+	#with the same bias voltages, solver and cell parameters only the strings with dirty cells (see gridstate.markDirty)
+	#are solved again, and the other ones take their last currents
+	def solve(self,grid,vbias):
+		vbias = np.atleast_1d( np.asarray(vbias, dtype=float) )
+		key = ( self.backendKey(), tuple(grid.parameters.get_parameters(25.0)), grid.state.diode_temp.shape )
+		last = grid.solution
+		if last is not None and last["key"] == key and np.array_equal(last["vbias"], vbias):
+			strings = np.flatnonzero(grid.state.dirtyStrings())
+			I = last["I"].copy()
+			bypass = dict(last["bypass"])
+		else:
+			strings = np.arange(len(grid.modules))
+			I = np.zeros((len(grid.modules), len(vbias)))
+			bypass = {}
+
+		if len(strings) > 0:
+			plan = solverplan(grid,self.tnom,strings)
+			Is, Ibypass = self.solvePlan(plan,vbias)
+			I[strings] = Is
+			for s in strings.tolist():
+				bypass[s] = ( [], [] )
+			for probe, values in zip(plan.bypass_probes, Ibypass):
+				bypass[probe[0]][0].append(probe)
+				bypass[probe[0]][1].append(values)
+		grid.state.clearDirty(strings)
+		if len(strings) > 0:
+			grid.operating_points = None		#it depends on the dirty flags too
+		grid.solution = { "key": key, "vbias": vbias.copy(), "I": I, "bypass": bypass }
+
+		bypass_probes = [ probe for s in range(len(grid.modules)) for probe in bypass[s][0] ]
+		Ibypass = np.array([ values for s in range(len(grid.modules)) for values in bypass[s][1] ]).reshape(-1, len(vbias))
+		return I.copy(), Ibypass, bypass_probes
+
+	#	Global maximum power point of the grid. Each bypass diode that turns on can create a local maximum, close to the
+	#voltage of the cells that are not bypassed, so the voltage range is split on the open circuit voltages of the
+	#units of each string, summed from the smallest unit (the bypass segments of diode_list). The power is sampled inside
+	#each interval and the bracket of each sampled local maximum (its neighbouring samples) is sampled again with "zoom"
+	#voltages, until it is smaller than xtol. All the candidates are sampled at once, so each iteration is a single
+	#solution and the bracket is reduced about zoom/2 times per iteration. Returns (voltage, current, power)
+	def globalMpp(self,grid,xtol=1e-3,samples=4,zoom=16):
+		return self.planMpp(solverplan(grid,self.tnom), grid.parameters.Voc/grid.parameters.Ns, xtol, samples, zoom)
+
+	def planMpp(self,plan,vcell,xtol=1e-3,samples=4,zoom=16):	#globalMpp of a solverplan, vcell is the open circuit voltage of a cell
+		vmpp, Impp, Pmpp = self.planPeaks(plan,vcell,xtol,samples,zoom)
+		best = np.argmax(Pmpp)
+		return vmpp[best], Impp[best], Pmpp[best]
+
+	#	Local maxima of the power of a solverplan (voltage, current and power arrays, sorted by voltage). The power is
+	#sampled between the voltages where bypass diodes may turn on and each sampled peak is refined by zooming around it
+	def planPeaks(self,plan,vcell,xtol=1e-3,samples=4,zoom=16):
+		unit_cells = np.add.reduceat(plan.entry_count, plan.unit_ptr)
+		bounds = [ 0.0 ]
+		for s in range(plan.nstrings):
+			units = plan.unit_string == s
+			cells = np.sort(np.repeat(unit_cells[units], plan.unit_mult[units].astype(int)))
+			bounds.extend( (np.cumsum(cells)*vcell).tolist() )
+		bounds = np.unique(bounds)
+		upperv = bounds[-1]
+		v = np.concatenate([ np.linspace(a, b, samples, endpoint=False) for a, b in zip(bounds[:-1], bounds[1:]) ] + [ [upperv] ])
+		P = v*np.sum(self.solvePlan(plan,v)[0], axis=0)
+
+		peaks = np.flatnonzero( (P >= np.concatenate(([-np.inf], P[:-1]))) & (P >= np.concatenate((P[1:], [-np.inf]))) )
+		return self.refinePeaks(plan,v,peaks,xtol,zoom)
+
+	#	All the local maxima of the power of a solverplan, down to a voltage resolution: the curve is sampled by an
+	#adaptivesweep (steps down to "precision" around the knees of the bypass diodes, where the local maxima are, and
+	#around every sampled peak) and each sampled peak is refined as on planPeaks. Maxima closer than "precision" to
+	#another one, or with a dip smaller than "prominence" times the largest power to a higher neighbour maximum, are
+	#not counted apart. Such a dip is a current dip of about prominence*Pmax/upperv under the chord of the curve, so
+	#this is the tolerance of the sweep, updated with the largest power sampled so far: only the intervals that may
+	#hold a counted maximum are refined (prominence 0 samples the whole curve with steps of "precision")
+	def sweepPeaks(self,plan,upperv,precision=0.01,xtol=1e-3,prominence=1e-4,zoom=16):
+		sweep = adaptivesweep(upperv, precision, 0.0, maxpoints=np.inf)
+		def evaluate(segments,points):
+			I = np.sum(self.solvePlan(plan,points)[0], axis=0)
+			sweep.tol = max(sweep.tol, prominence*np.max(points*I)/upperv)
+			return points, I, np.zeros((0, len(points)))
+		v, I, columns = sweep.run(evaluate)
+		P = v*I
+		peaks = np.flatnonzero( (P > np.concatenate(([-np.inf], P[:-1]))) & (P >= np.concatenate((P[1:], [-np.inf]))) )
+		keep = []
+		for k in peaks.tolist():		#prominence: height over the highest of the lowest points up to a higher peak on each side
+			higher = peaks[P[peaks] > P[k]]
+			left = higher[higher < k]
+			right = higher[higher > k]
+			low_left = np.min(P[left[-1] if len(left) else 0 : k+1])
+			low_right = np.min(P[k : right[0]+1 if len(right) else len(P)])
+			keep.append(P[k] - max(low_left, low_right) > prominence*np.max(P))
+		return self.refinePeaks(plan,v,peaks[keep],xtol,zoom)
+
+	def refinePeaks(self,plan,v,peaks,xtol,zoom):	#zooms around the sampled peaks (indexes of v) down to xtol
+		a = v[np.maximum(peaks - 1, 0)]
+		b = v[np.minimum(peaks + 1, len(v) - 1)]
+		rows = np.arange(len(peaks))
+		while np.max(b - a) > xtol:
+			x = a[:,None] + (b - a)[:,None]*np.linspace(0, 1, zoom)[None,:]
+			Px = (x.ravel()*np.sum(self.solvePlan(plan,x.ravel())[0], axis=0)).reshape(x.shape)
+			k = np.argmax(Px, axis=1)
+			a = x[rows, np.maximum(k - 1, 0)]
+			b = x[rows, np.minimum(k + 1, zoom - 1)]
+		vmpp = 0.5*(a + b)
+		vmpp = vmpp[ np.concatenate(([True], np.diff(vmpp) > 2*xtol)) ]		#windows that reached the same peak
+		Impp = np.sum(self.solvePlan(plan,vmpp)[0], axis=0)
+		return vmpp, Impp, vmpp*Impp
+
+	#	Maximum power point of each string of a plan on its own (not connected to the other strings). The search is
+	#done on the string current: the voltage of a string is explicit on its current, so strings with different
+	#voltages are solved together. Returns the arrays vmpp, impp and pmpp of the solved strings
+	def stringMpp(self,plan,xtol=1e-4,samples=32,zoom=16,candidates=2):
+		voltage = lambda I: self.stringVoltage(plan,I)[0]
+		return self.currentMpp(voltage, self.stringPhotocurrent(plan), xtol, samples, zoom, candidates)
+
+	def cellMpp(self,plan,xtol=1e-4,samples=32,zoom=16):	#maximum power point of each entry of a plan on its own
+		cells = copy.copy(plan)
+		cells.entry_unit = np.arange(len(plan.entry_unit))
+		voltage = lambda I: self.cellVoltage(cells,I)[0]
+		return self.currentMpp(voltage, plan.entry_iph, xtol, samples, zoom, 1)
+
+	#	Maximum power point of each row of voltage(I) (rows x currents), with currents from 0 to Imax of the row: the
+	#"candidates" best peaks of the power sampled on "samples" currents are refined by zooming around them
+	#(one evaluation per iteration) down to xtol (A)
+	def currentMpp(self,voltage,Imax,xtol,samples,zoom,candidates):
+		nrows = len(Imax)
+		rows = np.arange(nrows)[:,None]
+		I = Imax[:,None]*np.linspace(0, 1, samples)[None,:]
+		P = I*voltage(I)
+		peak = (P >= np.pad(P, ((0,0),(1,0)), constant_values=-np.inf)[:,:-1]) & (P >= np.pad(P, ((0,0),(0,1)), constant_values=-np.inf)[:,1:])
+		k = np.argsort(np.where(peak, -P, np.inf), axis=1, kind="stable")[:,:candidates]	#the best sample is always a peak
+		a = I[rows, np.maximum(k - 1, 0)]
+		b = I[rows, np.minimum(k + 1, samples - 1)]
+		while np.max(b - a, initial=0) > xtol:
+			x = a[:,:,None] + (b - a)[:,:,None]*np.linspace(0, 1, zoom)[None,None,:]
+			Px = x*voltage(x.reshape(nrows, -1)).reshape(x.shape)
+			k = np.argmax(Px, axis=2)[:,:,None]
+			a = np.take_along_axis(x, np.maximum(k - 1, 0), axis=2)[:,:,0]
+			b = np.take_along_axis(x, np.minimum(k + 1, zoom - 1), axis=2)[:,:,0]
+		impp = 0.5*(a + b)
+		vmpp = voltage(impp)
+		best = np.argmax(vmpp*impp, axis=1)[:,None]
+		vmpp = np.take_along_axis(vmpp, best, axis=1)[:,0]
+		impp = np.take_along_axis(impp, best, axis=1)[:,0]
+		return vmpp, impp, vmpp*impp
+
+	#	Open circuit voltage of the grid: the grid current is sampled on "samples" voltages of the bracket, which is then
+	#reduced to the samples around the zero current (one solution per iteration) down to xtol
+	def planVoc(self,plan,lo,hi,xtol=1e-3,samples=16):
+		grid_current = lambda v: np.sum(self.solvePlan(plan,v)[0], axis=0)
+		while grid_current([hi])[0] > 0:
+			hi = 2*hi + 1.0
+		while hi - lo > xtol:
+			v = np.linspace(lo, hi, samples)
+			I = grid_current(v)
+			k = np.clip( np.searchsorted(-I, 0.0) - 1, 0, samples - 2 )	#the current decreases with the voltage
+			lo, hi = v[k], v[k+1]
+		return 0.5*(lo + hi)
+
+	#	Main values of the grid on its present conditions: maximum power point, open circuit voltage, short circuit
+	#current and the current of each string on the maximum power point (used by timeseries). The result is kept on
+	#grid.operating_points and returned again while no cell is changed (see gridstate.markDirty). The strings of the
+	#grid share the bias voltage, so any changed string needs a new search: the unchanged strings start from their
+	#last solution (see warmStart). Clearing the dirty flags also drops grid.solution, which depends on them
+	def operatingPoints(self,grid,xtol=1e-3):
+		key = ( self.backendKey(), tuple(grid.parameters.get_parameters(25.0)), grid.state.diode_temp.shape, xtol )
+		last = grid.operating_points
+		dirty = grid.state.dirtyStrings()
+		if last is not None and last["key"] == key and not np.any(dirty):
+			return dict(last["result"])
+		plan = solverplan(grid,self.tnom)
+		vmpp, impp, pmpp = self.planMpp(plan, grid.parameters.Voc/grid.parameters.Ns, xtol)
+		I = self.solvePlan(plan,[0.0, vmpp])[0]
+		voc = self.planVoc(plan, vmpp, grid.nserie*grid.parameters.Voc, xtol) if impp > 0 else 0.0
+		result = { "vmpp": vmpp, "impp": impp, "pmpp": pmpp, "voc": voc, "isc": np.sum(I[:,0]), "strings": I[:,1] }
+		if np.any(dirty):
+			grid.solution = None
+		grid.state.clearDirty()
+		grid.operating_points = { "key": key, "result": result }
+		return dict(result)
+
+	def solvePlan(self,plan,vbias):		#string and bypass diode currents of a solverplan
+		vbias = np.atleast_1d( np.asarray(vbias, dtype=float) )
+		if self.workers > 1 and plan.nstrings > 1 and len(plan.entry_unit)*len(vbias) >= self.parallel_size:
+			I, Ibp = self.solveParallel(plan,vbias)
+		else:
+			I, Ibp = self.solveStrings(plan,vbias)
+		I = I[plan.string_class]		#currents of all the strings of the grid
+		Ibypass = np.array([ Ibp[unit] for s, module, num, unit in plan.bypass_probes ]).reshape(-1, len(vbias))
+		return I, Ibypass
+
+	def solveStrings(self,plan,vbias):	#currents of the solved strings and bypass diode currents of every unit of a plan
+		I = self.stringCurrent(plan,vbias)
+		Ibp = self.unitVoltage(plan,I,np.arange(len(vbias)))[2]
+		if self.warm_start:
+			self.keepSolution(plan,vbias,I,Ibp)
+		return I, Ibp
+
+	#	Same as solveStrings, with the solved strings split among self.workers processes of self.pool: all the strings
+	#share the bias voltage, so each one is solved alone. Each process receives the subset of the plan with its strings
+	#and their warm start solutions only (see solve_group), writes the currents of its strings and of their units on a
+	#shared memory block (one row per solved string, then one row per unit) and returns its warm start solutions and
+	#statistics, which are merged on this solver
+	def solveParallel(self,plan,vbias):
+		if self.pool is None:
+			self.pool = ProcessPoolExecutor(max_workers=self.workers)
+		groups = [ group for group in np.array_split(np.arange(plan.nstrings), self.workers) if len(group) > 0 ]
+		shape = (plan.nstrings + len(plan.unit_string), len(vbias))
+		settings = (self.xtol, self.maxiter, self.warm_start, self.rprobe, self.tnom)
+		memory = shared_memory.SharedMemory(create=True, size=8*shape[0]*shape[1])
+		try:
+			futures = []
+			for group in groups:
+				subplan = plan.subset(group)
+				warm = { s: self.warm[s] for s in subplan.string_rep.tolist() if s in self.warm }
+				futures.append( self.pool.submit(solve_group, settings, warm, subplan, vbias, memory.name, shape, group, plan.nstrings) )
+			for future in futures:
+				warm, stats = future.result()
+				self.warm.update(warm)
+				for key, value in stats.items():
+					self.stats[key] += value
+			result = np.ndarray(shape, dtype=float, buffer=memory.buf).copy()
+		finally:
+			memory.close()
+			memory.unlink()
+		return result[:plan.nstrings], result[plan.nstrings:]
+
+	#	Equivalent of netlist.defaultRun + LTspice + extract_raw_file: sweeps the bias voltage from 0 to upperv
+	#with a step equal to precision and returns an object with the same probe attributes of extract_raw_file
+	def defaultRun(self,grid,upperv,precision, probe_strings=True, probe_bypassdiode=True, name="Native solver"):
+		npoints = int( np.floor(upperv/precision + 1e-9) ) + 1
+		vbias = precision*np.arange(npoints)
+		I, Ibypass, bypass_probes = self.solve(grid,vbias)
+		return self.makeOutput(name, vbias, I, Ibypass, bypass_probes, probe_strings, probe_bypassdiode)
+
+	#	Same as defaultRun, but with the bias voltages chosen by an adaptivesweep: the steps are only as small as
+	#"precision" around the knees of the curve and the maximum power points
+	def adaptiveRun(self,grid,upperv,precision, tol=None, probe_strings=True, probe_bypassdiode=True, name="Native solver"):
+		plan = solverplan(grid,self.tnom)
+		def evaluate(segments,points):
+			I, Ibypass = self.solvePlan(plan,points)
+			return points, np.sum(I, axis=0), np.vstack((I, Ibypass))
+		v, I, columns = adaptivesweep(upperv, precision, tol).run(evaluate)
+		nstrings = len(grid.modules)
+		return self.makeOutput(name, v, columns[:nstrings], columns[nstrings:], plan.bypass_probes, probe_strings, probe_bypassdiode)
+
+	def makeOutput(self,name,vbias,I,Ibypass,bypass_probes,probe_strings,probe_bypassdiode):	#native_output of a solution
+		npoints = len(vbias)
+		output = native_output(name)
+		output.steps = [ (0, npoints) ]
+		output.probe_vbias = node_value_class("vbias", "voltage", 0)
+		output.probe_vbias.values = vbias
+		output.probe_ibias = node_value_class("Grid", "device_current", 1)
+		output.probe_ibias.values = np.sum(I, axis=0)
+		if probe_strings:
+			for s in range(len(I)):
+				output.probe_strings.append( node_value_class('String n°{}'.format(s), "device_current", s + 2) )
+				output.probe_strings[-1].values = I[s]
+		if probe_bypassdiode:
+			for idx, (s, module, num, unit) in enumerate(bypass_probes):
+				output.probe_bypass.append( node_value_class('Bypass N°{} from S.{},P.{}'.format(num,s,module), "device_current", idx) )
+				output.probe_bypass[-1].values = Ibypass[idx]
+		return output
+
+#	Runs on a worker process of pvsolver.solveParallel: a solver with the "settings" of the parent one and the "warm"
+#start solutions of the strings of "plan" (the subset of the strings "group", the rows of its units start at "offset")
+def solve_group(settings,warm,plan,vbias,name,shape,group,offset):
+	xtol, maxiter, warm_start, rprobe, tnom = settings
+	solver = pvsolver(xtol, maxiter, warm_start)
+	solver.rprobe = rprobe
+	solver.tnom = tnom
+	solver.warm = warm
+	I, Ibp = solver.solveStrings(plan,vbias)
+	memory = shared_memory.SharedMemory(name=name)
+	try:
+		result = np.ndarray(shape, dtype=float, buffer=memory.buf)
+		result[group] = I
+		result[offset + plan.units] = Ibp
+		del result
+	finally:
+		memory.close()
+	return solver.warm, solver.stats
+
+""" class timeseries simulates a grid along time. The steps are dictionaries with the conditions of each time step
+	(see pvgrid.setConditions, values may be uniform or per module, cell or diode) and an optional "time" label. Each
+	step is solved by pvsolver.operatingPoints and its results (maximum power point, open circuit voltage, short circuit
+	current and the current of each string on the maximum power point) are written to a CSV file in chunks of
+	"chunk" lines, so the steps can come from a generator and a long series is never held in memory. Conditions not
+	given by a step keep the value of the previous step. """
+class timeseries:
+	def __init__(self,grid,solver=None,xtol=1e-3,chunk=1000):
+		self.grid = grid
+		self.solver = solver if solver is not None else pvsolver()
+		self.xtol = xtol
+		self.chunk = chunk
+		self.nsteps = 0
+		self.energy = 0.0		#sum of the maximum power of the steps (times the step duration, if given, is the energy)
+
+	def columns(self):
+		return [ "time", "vmpp", "impp", "pmpp", "voc", "isc" ] + [ "string{}".format(s) for s in range(len(self.grid.modules)) ]
+
+	def solveStep(self,step):	#list with the results of one step (same order of columns)
+		self.grid.setConditions(step)
+		if np.all(self.grid.state.cell_irrad <= 0):		#night: no solution is needed
+			return [ step.get("time", self.nsteps), 0.0, 0.0, 0.0, 0.0, 0.0 ] + [ 0.0 ]*len(self.grid.modules)
+		result = self.solver.operatingPoints(self.grid, self.xtol)
+		return [ step.get("time", self.nsteps) ] + [ float(result[key]) for key in ("vmpp", "impp", "pmpp", "voc", "isc") ] + result["strings"].tolist()
+
+	def iterRun(self,steps):	#generator of the results of each step
+		for step in steps:
+			row = self.solveStep(step)
+			self.nsteps += 1
+			self.energy += row[3]
+			yield row
+
+	def run(self,steps,filepath):	#solves all the steps, writing the results to the CSV file "filepath"
+		with open(filepath, "w", newline="", encoding="utf-8") as f:
+			writer = csv.writer(f)
+			writer.writerow(self.columns())
+			rows = []
+			for row in self.iterRun(steps):
+				rows.append(row)
+				if len(rows) >= self.chunk:
+					writer.writerows(rows)
+					rows = []
+			writer.writerows(rows)
+		return self.nsteps
+
+	#	Generator of steps read from a CSV file with the columns "time", "temperature" and "irradiance" (uniform
+	#conditions), read line by line
+	@staticmethod
+	def iterCSV(filepath):
+		with open(filepath, newline="") as f:
+			for line in csv.DictReader(f):
+				yield { "time": line["time"], "temperature": float(line["temperature"]), "irradiance": float(line["irradiance"]) }
+
+""" class montecarlo studies the mismatch between the cells of a grid: on each realization the I0, Iph, Rs and Rsh of
+	every cell are multiplied by random factors and the maximum power of the grid is compared to the sum of the maximum
+	power of its cells (mismatch loss). The distributions are given per parameter as (kind, spread), where kind is
+	"normal" (factor 1 + spread*N(0,1)), "uniform" (factor between 1 - spread and 1 + spread) or "lognormal" (factor
+	exp(spread*N(0,1))), or as a function f(rng, size) returning the factors. Parameters not given are not perturbed.
+		The realizations are solved in batches of "batch" realizations on one solverplan: for a grid with a single
+	string all the strings of the batch are solved together (pvsolver.stringMpp), otherwise each realization is solved by
+	pvsolver.planMpp. The batches may run on a process pool. """
+class montecarlo:
+	PARAMETERS = { "i0": "entry_i0", "iph": "entry_iph", "rs": "entry_rs", "rsh": "entry_rsh" }
+	DISTRIBUTIONS = ("normal", "uniform", "lognormal")
+
+	def __init__(self,grid,distributions,solver=None,xtol=1e-3,batch=16):
+		for name, distribution in distributions.items():
+			if name not in self.PARAMETERS:
+				raise ValueError("unknown cell parameter {} (use {})".format(name, ", ".join(self.PARAMETERS)))
+			if not callable(distribution) and distribution[0] not in self.DISTRIBUTIONS:
+				raise ValueError("unknown distribution {} (use {})".format(distribution[0], ", ".join(self.DISTRIBUTIONS)))
+		self.distributions = dict(distributions)
+		self.solver = solver if solver is not None else pvsolver()
+		self.plan = solverplan(grid, self.solver.tnom, compress=False)
+		self.vcell = grid.parameters.Voc/grid.parameters.Ns
+		self.xtol = xtol
+		self.batch = batch
+		self.pmpp = np.zeros(0)		#maximum power of the grid on each realization
+		self.ideal = np.zeros(0)	#sum of the maximum power of the cells on each realization
+
+	def factors(self,rng,distribution,size):		#random factors of one parameter
+		if callable(distribution):
+			f = np.asarray(distribution(rng, size), dtype=float)
+		elif distribution[0] == "normal":
+			f = 1 + distribution[1]*rng.standard_normal(size)
+		elif distribution[0] == "uniform":
+			f = rng.uniform(1 - distribution[1], 1 + distribution[1], size)
+		else:
+			f = np.exp(distribution[1]*rng.standard_normal(size))
+		return np.maximum(f, 1e-6)		#the parameters stay positive
+
+	def realize(self,rng,n):		#plan with n realizations of the grid (one after the other)
+		plan = self.plan.repeat(n)
+		for name, distribution in self.distributions.items():
+			attribute = self.PARAMETERS[name]
+			setattr(plan, attribute, getattr(plan, attribute)*self.factors(rng, distribution, len(plan.entry_unit)))
+		return plan
+
+	def runBatch(self,n,seed):		#maximum power of the grid and of its cells on n realizations
+		rng = np.random.default_rng(seed)
+		nstrings = self.plan.nstrings
+		plan = self.realize(rng, n)
+		pcell = self.solver.cellMpp(plan, self.xtol)[2]
+		ideal = np.bincount(plan.unit_string[plan.entry_unit]//nstrings, weights=plan.entry_count*pcell, minlength=n)
+		if nstrings == 1:
+			pmpp = self.solver.stringMpp(plan, self.xtol)[2]
+		else:
+			nunits = len(self.plan.unit_string)
+			nentries = len(self.plan.entry_unit)
+			pmpp = np.zeros(n)
+			for r in range(n):
+				single = self.plan.repeat(1)
+				for attribute in self.PARAMETERS.values():
+					setattr(single, attribute, getattr(plan, attribute)[r*nentries:(r + 1)*nentries])
+				pmpp[r] = self.solver.planMpp(single, self.vcell, self.xtol)[2]
+		return pmpp, ideal
+
+	#	Solves "realizations" realizations (added to the ones already solved), with "workers" processes (all the
+	#processors by default, 1 runs on this process). The same seed gives the same results for any number of workers
+	def run(self,realizations,seed=None,workers=None):
+		sizes = [ self.batch ]*(realizations//self.batch) + ([ realizations % self.batch ] if realizations % self.batch else [])
+		seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+		if workers == 1:
+			results = [ self.runBatch(n, s) for n, s in zip(sizes, seeds) ]
+		else:
+			with ProcessPoolExecutor(max_workers=workers) as pool:
+				results = list(pool.map(self.runBatch, sizes, seeds))
+		self.pmpp = np.concatenate([ self.pmpp ] + [ pmpp for pmpp, ideal in results ])
+		self.ideal = np.concatenate([ self.ideal ] + [ ideal for pmpp, ideal in results ])
+		return self.pmpp
+
+	def loss(self):		#mismatch loss of each realization (fraction of the maximum power of the cells)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return np.where(self.ideal > 0, 1 - self.pmpp/self.ideal, 0.0)
+
+	def summary(self,percentiles=(1, 5, 50, 95, 99)):	#distributions of the maximum power and of the mismatch loss
+		result = { "realizations": len(self.pmpp) }
+		for name, values in (("pmpp", self.pmpp), ("loss", self.loss())):
+			if len(values) == 0:
+				continue
+			result[name + "_mean"] = float(np.mean(values))
+			result[name + "_std"] = float(np.std(values))
+			for p, value in zip(percentiles, np.percentile(values, percentiles)):
+				result["{}_p{}".format(name, p)] = float(value)
+		return result
+
+	def report(self):
+		result = self.summary()
+		if result["realizations"] == 0:
+			return "no realizations"
+		return "{} realizations: Pmpp {:.2f} +- {:.2f} W (p5 {:.2f}, p95 {:.2f}), mismatch loss {:.3%} +- {:.3%} (p95 {:.3%})".format(
+			result["realizations"], result["pmpp_mean"], result["pmpp_std"], result["pmpp_p5"], result["pmpp_p95"],
+			result["loss_mean"], result["loss_std"], result["loss_p95"])
+
+	def write(self,filepath):	#CSV file with the results of each realization
+		with open(filepath, "w", newline="", encoding="utf-8") as f:
+			writer = csv.writer(f)
+			writer.writerow([ "pmpp", "cells_pmpp", "loss" ])
+			writer.writerows(np.column_stack((self.pmpp, self.ideal, self.loss())).tolist())
+
+""" class shadingsweep evaluates many shading patterns of a grid. The masks are a 3-D array (pattern x module x cell),
+	with the modules ordered string by string (module = string*nserie + position), and each value is the fraction of
+	the present irradiance of the cell that reaches it (1 unshaded, 0 fully shaded). For each pattern the table has the
+	global maximum power point, the number of local maxima of the power and the bypass diodes conducting on the
+	global maximum power point (written as "string.module.diode"). The local maxima near the knees of the curve are
+	shallow and close to each other, so the curve is sampled down to "precision" (V) around the knees and the peaks
+	(see pvsolver.sweepPeaks): a local maximum is counted when it is farther than "precision" from the other ones and
+	its prominence is larger than "prominence" times the global maximum power. The patterns are solved in chunks of "chunk" patterns, which may
+	run on a process pool. The conditions of the grid are restored after the sweep. """
+class shadingsweep:
+	def __init__(self,grid,solver=None,xtol=1e-3,precision=0.01,prominence=1e-4,chunk=16):
+		self.grid = grid
+		self.solver = solver if solver is not None else pvsolver()
+		self.xtol = xtol
+		self.precision = precision
+		self.prominence = prominence
+		self.chunk = chunk
+		self.rows = []
+
+	def columns(self):
+		return [ "pattern", "vmpp", "impp", "pmpp", "local_maxima", "active_bypass", "bypass_diodes" ]
+
+	def solvePattern(self,pattern):		#row of the table for the present conditions of the grid
+		grid = self.grid
+		plan = solverplan(grid, self.solver.tnom)
+		vpeak, Ipeak, Ppeak = self.solver.sweepPeaks(plan, grid.nserie*(grid.parameters.Voc + 1), self.precision, self.xtol, self.prominence)
+		best = np.argmax(Ppeak)
+		Ibypass = self.solver.solvePlan(plan, [vpeak[best]])[1]
+		active = [ "{}.{}.{}".format(s, module, num) for (s, module, num, unit), Ibp in zip(plan.bypass_probes, Ibypass[:,0]) if Ibp > 0 ]
+		return [ pattern, float(vpeak[best]), float(Ipeak[best]), float(Ppeak[best]), int(np.sum(Ppeak > 0)), len(active), " ".join(active) ]
+
+	def runChunk(self,first,masks):		#rows of the patterns first, first + 1, ...
+		state = self.grid.state
+		irrad = state.cell_irrad.copy()
+		rows = []
+		try:
+			for p, mask in enumerate(masks):
+				self.grid.setCellIrrad(irrad*mask.reshape(irrad.shape))
+				rows.append(self.solvePattern(first + p))
+		finally:
+			self.grid.setCellIrrad(irrad)
+		return rows
+
+	#	Solves all the patterns with "workers" processes (all the processors by default, 1 runs on this process) and
+	#returns the rows of the table, in the order of the patterns
+	def run(self,masks,workers=None):
+		masks = np.asarray(masks, dtype=float)
+		shape = self.grid.state.cell_irrad.shape
+		if masks.ndim != 3 or masks.shape[1:] != (shape[0]*shape[1], shape[2]):
+			raise ValueError("Masks of shape {} do not match the grid (patterns x {} modules x {} cells)".format(masks.shape, shape[0]*shape[1], shape[2]))
+		firsts = range(0, len(masks), self.chunk)
+		if workers == 1:
+			chunks = [ self.runChunk(first, masks[first:first + self.chunk]) for first in firsts ]
+		else:
+			with ProcessPoolExecutor(max_workers=workers) as pool:
+				chunks = list(pool.map(self.runChunk, firsts, [ masks[first:first + self.chunk] for first in firsts ]))
+		self.rows = list(chain.from_iterable(chunks))
+		return self.rows
+
+	def write(self,filepath):	#CSV file with the table
+		with open(filepath, "w", newline="", encoding="utf-8") as f:
+			writer = csv.writer(f)
+			writer.writerow(self.columns())
+			writer.writerows(self.rows)
+
+""" class native_output is the container returned by pvsolver.defaultRun. It has the same attributes of the
+	extract_raw_file class (name, probe_vbias, probe_ibias, probe_strings and probe_bypass), so the results can
+	be handled exactly as the ones read from a LTspice .raw file. """
+class native_output:
+	def __init__(self,name):
+		self.name = name
+		self.probe_vbias = None
+		self.probe_ibias = None
+		self.probe_strings = []
+		self.probe_bypass = []
+		self.steps = None
+		self.num_steps = 1
+
+	get_step = extract_raw_file.get_step	#used by the stepped results restored by the result_cache
+
+""" class result_cache: 
+			Store of simulation results on a folder (by default "workspace/result_cache"), one .npz file per result.
+		Each result is addressed by a hash of the netlist lines (the "*" comments, which have the file name, are
+		not part of it), the simulator (backendKey of jobrunner or pvsolver) and RESULT_CACHE_VERSION, so an
+		unchanged grid is not simulated again. The stored results are returned as native_output objects. At most
+		"maxsize" results (and "maxbytes" bytes, if given) are kept: the least recently used are discarded.  """
+class result_cache:
+	def __init__(self,folder=os.path.join("workspace","result_cache"),maxsize=64,maxbytes=None):
+		self.folder = folder
+		self.maxsize = maxsize
+		self.maxbytes = maxbytes
+		self.hits = 0
+		self.misses = 0
+
+	def key(self,lines,backend):	#returns the key of a netlist (any iterable of lines) simulated by "backend"
+		sha = hashlib.sha1()
+		sha.update("{}\n{}\n".format(RESULT_CACHE_VERSION, backend).encode("utf-8"))
+		for line in lines:
+			if not line.startswith("*"):
+				sha.update(line.encode("utf-8"))
+				sha.update(b"\n")
+		return sha.hexdigest()
+
+	def filepath(self,key):
+		return os.path.join(self.folder, key + ".npz")
+
+	def get(self,key,name=None):	#returns the stored result of the key, or None if it is not on the cache
+		filepath = self.filepath(key)
+		try:
+			with np.load(filepath, allow_pickle=False) as data:
+				output = self.restore(data, name)
+			os.utime(filepath)		#the modification time gives the least recently used results
+		except (OSError, ValueError, KeyError):
+			self.misses += 1
+			return None
+		self.hits += 1
+		return output
+
+	def restore(self,data,name):	#builds the native_output of a stored result
+		output = native_output(name if name is not None else str(data["name"]))
+		for kind, node_name, node_type, node_number, values in zip(data["kinds"], data["names"], data["types"], data["numbers"], data["values"]):
+			node = node_value_class(str(node_name), str(node_type), int(node_number))
+			node.values = values
+			if kind == 0:
+				output.probe_vbias = node
+			elif kind == 1:
+				output.probe_ibias = node
+			elif kind == 2:
+				output.probe_strings.append(node)
+			else:
+				output.probe_bypass.append(node)
+		output.steps = [ tuple(step) for step in data["steps"].tolist() ]
+		output.num_steps = len(output.steps)
+		return output
+
+	def put(self,key,output):	#method used to store a result (extract_raw_file or native_output), discarding the least recently used ones
+		nodes = [ (0, output.probe_vbias), (1, output.probe_ibias) ] + [ (2, node) for node in output.probe_strings ] + [ (3, node) for node in output.probe_bypass ]
+		steps = getattr(output, "steps", None)
+		if steps is None:
+			steps = [ (0, len(output.probe_vbias.values)) ]
+		os.makedirs(self.folder, exist_ok=True)
+		fd, tmppath = tempfile.mkstemp(dir=self.folder, prefix=".result", suffix=".tmp")
+		try:
+			with os.fdopen(fd, "wb") as f:
+				np.savez(f, name=output.name, kinds=[ kind for kind, node in nodes ],
+						 names=[ node.name for kind, node in nodes ], types=[ node.node_type for kind, node in nodes ],
+						 numbers=[ node.node_number for kind, node in nodes ],
+						 values=np.array([ np.asarray(node.values, dtype=float) for kind, node in nodes ]),
+						 steps=np.array(steps, dtype=np.int64).reshape(-1, 2))
+			os.replace(tmppath, self.filepath(key))
+		except BaseException:
+			os.remove(tmppath)
+			raise
+		self.evict()
+
+	def entries(self):		#stored results as (modification time, size, path), the least recently used first
+		entries = []
+		for filename in os.listdir(self.folder):
+			if filename.endswith(".npz"):
+				stat = os.stat(os.path.join(self.folder, filename))
+				entries.append( (stat.st_mtime, stat.st_size, os.path.join(self.folder, filename)) )
+		return sorted(entries)
+
+	def evict(self):		#method used to discard the least recently used results over the limits
+		entries = self.entries()
+		total = sum( size for mtime, size, path in entries )
+		while entries and ( len(entries) > self.maxsize or (self.maxbytes is not None and total > self.maxbytes) ):
+			mtime, size, path = entries.pop(0)
+			total -= size
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+
+	def clear(self):		#method used to erase all the stored results
+		if os.path.isdir(self.folder):
+			for mtime, size, path in self.entries():
+				os.remove(path)
+
+	def hitRate(self):
+		total = self.hits + self.misses
+		return self.hits / total if total else 0.0
+
+	def report(self):		#short description of the cache use
+		return "{} hits, {} misses ({:.1%} hit rate)".format(self.hits, self.misses, self.hitRate())
+
 ### END OF CLASSES ###
 
 
+""" Command line interface (python -m pvspice scenario.json [...]). Each scenario file describes one grid and its
+	conditions, it is simulated and its curves are written to a CSV file. Many files are run at the same time on a
+	process pool. Only the standard library and NumPy are used (no tkinter or matplotlib), so it runs on servers.
+		The scenario file is a JSON object (keys not given take the values in brackets):
+		"parameters_file": file saved by the SPSim window (datasheet values, grid size and bypass diodes), or
+		"Voc", "Isc", "Vmp", "Imp", "Kv", "Ki", "Ns", "nserie", "nparallel" [1, 1] and "bypass" (same list of the window),
+		"temperature" [25.0] and "irradiance" [1000.0]: module values, scalar or nested lists (per string or per module),
+		"cell_temperature", "cell_irradiance" and "diode_temperature": optional values per cell and per bypass diode,
+		"solver": "native" or "spice" ["native"], "precision": step of the bias voltage [0.5],
+		"workers": processes sharing the strings of a large grid on the native solver (see pvsolver.solveParallel) [1],
+		"upper_voltage": end of the bias sweep [nserie*(Voc + 1)], "probe_strings" [true], "probe_bypassdiode" [true],
+		"hierarchical": hierarchical netlist for the spice solver [false],
+		"steps": list of scenarios for a .step simulation of the spice solver (see pvgrid.scenarioArrays) [none],
+		"adaptive": adaptive bias sweep (see adaptivesweep), "precision" is then the smallest step [false],
+		"tol": current tolerance of the adaptive sweep [0.1% of the largest current],
+		"mpp_only": only the global maximum power point is found (pvgrid.find_global_mpp) and written [false],
+		"xtol": voltage tolerance of the maximum power point search [0.001],
+		"timeseries": CSV file (relative to the scenario file) with the columns time, temperature and irradiance. Each
+	line is solved by the class timeseries and the results are written to the CSV file, line after line [none]
+		"montecarlo": cell mismatch study (see montecarlo), an object with "realizations" [1000], "seed" [none], "workers"
+	(processes) [1] and the distributions of the cell parameters, e.g. "iph": ["normal", 0.02]. The maximum power, the
+	sum of the maximum power of the cells and the mismatch loss of each realization are written to the CSV file [none]
+		"shading": NumPy .npy file (relative to the scenario file) with the shading masks of the class shadingsweep. The
+	table of the patterns is written to the CSV file [none], "prominence": smallest dip between two local maxima
+	counted apart, relative to the global maximum power [0.0001]
+		With --result-cache, the results are kept on a result_cache folder and unchanged scenarios are not simulated again.
+		A GUI parameters file may be given directly instead of a JSON file (standard conditions are used). """
+
+def read_parameters_file(filepath):		#reads a file written by Window.save_parameters
+	with open(filepath) as f:
+		lines = [ line.rstrip("\n") for line in f ]
+	if len(lines) < 10 or lines[0] != "SolarSim datasheet values file":
+		raise ValueError("{} is not a SPSim parameters file".format(filepath))
+	keys = ("Ns", "Voc", "Isc", "Vmp", "Imp", "Kv", "Ki", "nserie", "nparallel")
+	scenario = { key: float(value) for key, value in zip(keys, lines[1:10]) }
+	for key in ("Ns", "nserie", "nparallel"):
+		scenario[key] = int(scenario[key])
+	scenario["bypass"] = [ json.loads(line) for line in lines[10:] if line != "" ]
+	return scenario
+
+def load_scenario(filepath):
+	with open(filepath, "rb") as f:
+		head = f.read(64)
+	if head.startswith(b"SolarSim datasheet values file"):
+		return read_parameters_file(filepath)
+	with open(filepath) as f:
+		scenario = json.load(f)
+	if "parameters_file" in scenario:		#relative to the scenario file
+		parameters = read_parameters_file(os.path.join(os.path.dirname(filepath), scenario.pop("parameters_file")))
+		parameters.update(scenario)
+		scenario = parameters
+	return scenario
+
+def build_grid(scenario,cache=None):		#creates the pvgrid described by a scenario
+	missing = [ key for key in ("Voc", "Isc", "Vmp", "Imp", "Kv", "Ki", "Ns") if key not in scenario ]
+	if missing:
+		raise ValueError("missing datasheet values: {}".format(", ".join(missing)))
+	grid = pvgrid(scenario.get("nserie", 1), scenario.get("nparallel", 1), scenario["Voc"], scenario["Isc"], scenario["Vmp"],
+				  scenario["Imp"], scenario["Kv"], scenario["Ki"], scenario["Ns"], cache=cache)
+	bypass = scenario.get("bypass", [])
+	if len(bypass) == grid.parameters.Ns:	#same check of the window, an incomplete list means no bypass diodes
+		grid.setBypassList(bypass)
+	grid.changeGridTemp(25.0)
+	grid.changeGridIrrad(1000.0)
+	grid.setConditions(scenario)
+	return grid
+
+def write_csv(filepath,output):		#writes the probes of a result (extract_raw_file or native_output) as CSV columns
+	nodes = [ output.probe_vbias, output.probe_ibias ] + list(output.probe_strings) + list(output.probe_bypass)
+	columns = np.column_stack([ np.asarray(node.values, dtype=float) for node in nodes ])
+	with open(filepath, "w", newline="", encoding="utf-8") as f:
+		writer = csv.writer(f)
+		writer.writerow([ node.name for node in nodes ])
+		writer.writerows(columns.tolist())
+
+#	Simulates one scenario file and returns the list of CSV files written and whether the result came from the
+#result_cache (None when the result_cache is not used: no result folder, timeseries, shading, montecarlo and mpp_only
+#scenarios). The netlist and the .raw file of the spice solver are kept next to the CSV file
+def run_scenario(filepath,output_dir=None,cache_filepath=None,timeout=None,result_folder=None):
+	scenario = load_scenario(filepath)
+	name = os.path.splitext(os.path.basename(filepath))[0]
+	if output_dir is None:
+		output_dir = os.path.dirname(os.path.abspath(filepath))
+	os.makedirs(output_dir, exist_ok=True)
+	cache = parameters_cache(cache_filepath) if cache_filepath is not None else None
+	grid = build_grid(scenario, cache)
+	upperv = scenario.get("upper_voltage", grid.nserie*(grid.parameters.Voc + 1))
+	precision = scenario.get("precision", 0.5)
+	probe_strings = scenario.get("probe_strings", True)
+	probe_bypassdiode = scenario.get("probe_bypassdiode", True)
+	solver = scenario.get("solver", "native")
+	csv_base = os.path.join(output_dir, name)
+	steps = scenario.get("steps")
+	netlist_options = (grid, upperv, precision, probe_strings, probe_bypassdiode, scenario.get("hierarchical", False), steps)
+
+	adaptive = scenario.get("adaptive", False)
+	if adaptive and steps is not None:
+		raise ValueError("{}: steps can not be used with the adaptive sweep".format(filepath))
+	if solver == "native":
+		if steps is not None:
+			raise ValueError("{}: steps are only available for the spice solver".format(filepath))
+		simulator = pvsolver(workers=scenario.get("workers", 1))
+	elif solver == "spice":
+		simulator = jobrunner(timeout=timeout)
+	else:
+		raise ValueError("{}: unknown solver {}".format(filepath, solver))
+
+	try:
+		if "timeseries" in scenario:
+			if solver != "native" or steps is not None or adaptive:
+				raise ValueError("{}: timeseries is only available for the native solver".format(filepath))
+			series = timeseries(grid, simulator, scenario.get("xtol", 1e-3))
+			series.run(timeseries.iterCSV(os.path.join(os.path.dirname(filepath), scenario["timeseries"])), csv_base + ".csv")
+			return [ csv_base + ".csv" ], None
+
+		if "shading" in scenario:
+			if solver != "native" or steps is not None or adaptive:
+				raise ValueError("{}: shading is only available for the native solver".format(filepath))
+			sweep = shadingsweep(grid, simulator, scenario.get("xtol", 1e-3), prominence=scenario.get("prominence", 1e-4))
+			sweep.run(np.load(os.path.join(os.path.dirname(filepath), scenario["shading"])), workers=1)
+			sweep.write(csv_base + ".csv")
+			return [ csv_base + ".csv" ], None
+
+		if "montecarlo" in scenario:
+			if solver != "native" or steps is not None or adaptive:
+				raise ValueError("{}: montecarlo is only available for the native solver".format(filepath))
+			options = dict(scenario["montecarlo"])
+			realizations = options.pop("realizations", 1000)
+			seed = options.pop("seed", None)
+			workers = options.pop("workers", 1)
+			study = montecarlo(grid, options, simulator, scenario.get("xtol", 1e-3))
+			study.run(realizations, seed, workers)
+			study.write(csv_base + ".csv")
+			return [ csv_base + ".csv" ], None
+
+		if scenario.get("mpp_only", False):
+			if solver != "native" or steps is not None:
+				raise ValueError("{}: mpp_only is only available for the native solver".format(filepath))
+			with open(csv_base + ".csv", "w", newline="", encoding="utf-8") as f:
+				writer = csv.writer(f)
+				writer.writerow(["vmpp", "impp", "pmpp"])
+				writer.writerow([ float(value) for value in grid.find_global_mpp(simulator, scenario.get("xtol", 1e-3)) ])
+			return [ csv_base + ".csv" ], None
+
+		results = result_cache(result_folder) if result_folder is not None else None
+		output = None
+		if results is not None:
+			backend = simulator.backendKey() + (" adaptive tol={}".format(scenario.get("tol")) if adaptive else "")
+			key = results.key(netlist(name).iterDefaultNetlist(*netlist_options), backend)
+			output = results.get(key, name)
+		if output is None:
+			if adaptive and solver == "native":
+				output = simulator.adaptiveRun(grid, upperv, precision, tol=scenario.get("tol"), probe_strings=probe_strings,
+											   probe_bypassdiode=probe_bypassdiode, name=name)
+			elif adaptive:
+				output = simulator.adaptiveRun(grid, upperv, precision, csv_base, tol=scenario.get("tol"), probe_strings=probe_strings,
+											   probe_bypassdiode=probe_bypassdiode, hierarchical=scenario.get("hierarchical", False), name=name)
+			elif solver == "native":
+				output = simulator.defaultRun(grid, upperv, precision, probe_strings=probe_strings, probe_bypassdiode=probe_bypassdiode, name=name)
+			else:
+				nl = netlist(name)
+				with open(csv_base + ".cir", "w") as f:
+					nl.writeFile(f, nl.iterDefaultNetlist(*netlist_options))
+				job = simulator.runJob(simulationjob(csv_base + ".cir"))
+				if job.error is not None:
+					raise RuntimeError("{}: the simulation failed ({})".format(filepath, job.error))
+				output = job.result
+			if results is not None:
+				results.put(key, output)
+		outputs = [ output ] if steps is None else [ output.get_step(k) for k in range(output.num_steps) ]
+
+		if cache is not None:
+			cache.save()
+		if len(outputs) == 1:
+			csv_files = [ csv_base + ".csv" ]
+		else:
+			csv_files = [ "{}_step{}.csv".format(csv_base, k) for k in range(len(outputs)) ]
+		for csv_file, output in zip(csv_files, outputs):
+			write_csv(csv_file, output)
+		return csv_files, results.hits > 0 if results is not None else None
+	finally:
+		if solver == "native":
+			simulator.close()
+
+def main(argv=None):
+	import argparse
+	from concurrent.futures import ProcessPoolExecutor
+
+	parser = argparse.ArgumentParser(prog="python -m pvspice", description="Simulates PV grid scenario files and writes their curves as CSV files.")
+	parser.add_argument("scenarios", nargs="+", help="scenario files (JSON or SPSim parameters files)")
+	parser.add_argument("-o", "--output-dir", help="folder of the CSV files (default: next to each scenario file)")
+	parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of scenarios simulated at the same time")
+	parser.add_argument("--cache", help="parameters cache file shared by the runs (see parameters_cache)")
+	parser.add_argument("--timeout", type=float, help="seconds after which a spice simulation is killed")
+	parser.add_argument("--result-cache", help="folder of the stored results (see result_cache)")
+	args = parser.parse_args(argv)
+
+	failures = 0
+	results = result_cache(args.result_cache) if args.result_cache is not None else None	#only counts the hits of the runs
+	with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+		futures = { pool.submit(run_scenario, filepath, args.output_dir, args.cache, args.timeout, args.result_cache): filepath for filepath in args.scenarios }
+		for future in as_completed(futures):
+			try:
+				csv_files, cached = future.result()
+			except Exception as error:
+				failures += 1
+				print("{}: {}".format(futures[future], error), file=sys.stderr)
+				continue
+			for csv_file in csv_files:
+				print(csv_file)
+			if results is not None:
+				if cached is True:
+					results.hits += 1
+				elif cached is False:		#None: the scenario does not use the result_cache
+					results.misses += 1
+	if results is not None:
+		print("Result cache: {}".format(results.report()), file=sys.stderr)
+	return 1 if failures else 0
+
+
 if __name__ == "__main__":
-	nserie = 1
-	nparallel = 1
-	Voc = 43.5
-	Isc = 3.45
-	Vmp = 35
-	Imp = 3.15
-	Kv = -0.152
-	Ki = 0.0014
-	Ns = 72
-	temp = 25
-
-	grid1 = pvgrid(nserie,nparallel,Voc,Isc,Vmp,Imp,Kv,Ki,Ns,temp)
-	grid1.setBypassList(diodelist1)
-	nl = netlist("teste5")
-	grid1.changeGridTemp(60)
-	grid1.changeGridIrrad(800)
-
-	circuit = nl.defaultRun(grid1,nserie*(Voc+1),nserie*(Voc+1)/100)
-	#print (circuit)
-	print ( grid1.parameters.get_parameters(temp) )
-	print ( grid1.parameters.get_parameters(60) )
-	print ( grid1.modules[0][0].cells[0].Rs )
-	"""
-	grid1.cells[0][0].irradiance = 1000
-	grid1.cells[0][0].changeTemp(50)
-	grid1.cells[0][1].changeTemp(50)
-	grid1.cells[1][0].changeTemp(50)
-	grid1.cells[1][1].changeTemp(50)
-	nl = netlist("teste4")
-	circuit = nl.defaultRun(grid1,nserie*(Voc+1),0.1)
-	"""
-	f = open("teste7.cir","w")
-	for string in circuit:
-		f.write(string+"\n")
-	f.close
-
-
-	"""
-	grid1 = cellgrid(2,1,1,2,3,4,5,6,7,8,9)
-	nl1 = netlist("test1")
-	line1 = grid1.cells[0][0].writeCommandLine()
-	print (line1)
-
-	#nl1.addDotCommand("dc",0,0.7,0.01)
-	#nl1.addComponent(grid1.writeAllComponents())
-	list1 = nl1.defaultRun(grid1,2,0.01)
-	print (list1)
-	f = open("test2.cir","w")
-	for string in list1:
-		f.write(string+"\n")
-	f.close
-	"""
-	#system("scad3.exe -ascii -b -run teste3.cir")
\ No newline at end of file
+	sys.exit(main())